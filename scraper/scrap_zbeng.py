@@ -1,30 +1,141 @@
 import requests
 from bs4 import BeautifulSoup
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import functools
 import json
 import os
+import io
+import gzip
 import time
 import random
 import re
 import logging
+import multiprocessing
+import hashlib
+import html
+import shutil
+import signal
+import threading
+import tracemalloc
 from urllib.parse import urljoin  # For handling relative URLs robustly
 import bcrypt
 from datetime import datetime, timedelta
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain
+
+try:
+    import numpy as np  # Only needed for synth, sample and dedupe-photos modes
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image  # Only needed for dedupe-photos mode
+except ImportError:
+    Image = None
+
+try:
+    import pyarrow as pa  # Only needed for export mode; sample mode reads JSONL columns with it when present
+    import pyarrow.dataset as pads
+    import pyarrow.json as pajson
+except ImportError:
+    pa = None
+
+try:
+    import zstandard  # Preferred codec for compressed outputs; gzip is used when missing
+except ImportError:
+    zstandard = None
 
 # --- Configuration ---
-BASE_URL = "https://www.zbeng.co.il"
+# ZBENG_BASE_URL (or --base-url) points the scraper at another host, e.g. the local stand-in server
+BASE_URL = os.environ.get("ZBENG_BASE_URL", "https://www.zbeng.co.il").rstrip("/")
 # The view=2 parameter is used here. If you need to scrape other views (e.g., view=3),
 # you'll need to change this template or run the script multiple times.
-LISTING_URL_TEMPLATE = "https://www.zbeng.co.il/online.aspx?page={page_num}&view=2"
+LISTING_URL_TEMPLATE = BASE_URL + "/online.aspx?page={page_num}&view=2"
 
 # AJAX URL for fetching popup details (you confirmed this URL)
-USER_DETAILS_AJAX_URL_TEMPLATE = "https://www.zbeng.co.il/api/getprofile?customerId={user_id}"
+USER_DETAILS_AJAX_URL_TEMPLATE = BASE_URL + "/api/getprofile?customerId={user_id}"
+# Multiplier for the polite sleeps between requests; 0 disables them for offline benchmarks
+POLITE_DELAY_SCALE = float(os.environ.get("ZBENG_DELAY_SCALE", "1"))
 
 OUTPUT_DIR = "scraped_data_zbeng_full_refactor"  # New output directory
 PHOTOS_SUBDIR = "photos"
 JSON_FILENAME = "users_data_complete.json"
 SEED_JSON_FILENAME = "seed_users.json"  # User model compatible format
 LOG_FILENAME = "scraper.log"
+PHOTO_MANIFEST_FILENAME = "photo_manifest.json"  # (user_id, label, number) -> path, size, digest
+PHOTO_HASHES_FILENAME = "photo_hashes.json"  # Photo digest -> perceptual hashes, so dedupe only hashes new files
+PHOTO_DUPLICATES_FILENAME = "photo_duplicates.json"  # Near-duplicate clusters found by dedupe-photos
+PHOTO_SKIP_LIST_FILENAME = "photo_skip_list.txt"  # Photo filenames conversion leaves out of the seed data
+PHOTO_DUPLICATE_DISTANCE = 8  # Max Hamming distance, on both 64-bit hashes, for two photos to be duplicates
+PHOTO_STOCK_MIN_USERS = 3  # A cluster spanning this many users is a stock image or placeholder; all are skipped
+PHOTO_PART_SUFFIX = ".part"  # In-progress download; "<part>.json" records its URL and expected length
 SALT_ROUNDS = 12  # For bcrypt password hashing
+SYNTH_JSONL_FILENAME = "seed_users_synth.jsonl"  # Output of synth mode
+SYNTH_CHUNK_SIZE = 50000  # Users generated and written per chunk in synth mode
+SEED_SHARD_DIRNAME = "seed_shards"  # Sharded copy of the seed output for parallel loaders
+SYNTH_SHARD_DIRNAME = "synth_shards"
+SEED_SHARD_MANIFEST_FILENAME = "manifest.json"
+SEED_SHARD_MAX_BYTES = 32 * 1024 * 1024  # Upper bound on each seed shard file
+DEAD_LETTER_FILENAME = "dead_letters.json"  # Failed listing pages, detail fetches, photos and conversions
+MAX_DEAD_LETTER_ATTEMPTS = 5  # retry-failed gives up on entries that failed this many times
+SEED_REJECTS_FILENAME = "seed_rejects.jsonl"  # Seed records that failed User model validation
+# "gzip", "zstd" or "none" for raw/seed outputs. gzip is the default because every Node version the
+# server supports can read it; zstd (smaller, faster) needs Node 22.15+ in seed-from-scraped.js and
+# falls back to gzip when the zstandard package is missing. Opt in with ZBENG_COMPRESSION=zstd.
+DATA_COMPRESSION = os.environ.get("ZBENG_COMPRESSION", "gzip")
+ZSTD_LEVEL = 6
+GZIP_LEVEL = 6  # gzip's own default of 9 is about 3x slower for about 10% smaller output
+PROFILE_INDEX_FILENAME = "profile_index.json"  # Inverted index: field:value term -> user IDs, username -> user_id
+AGE_BUCKET_YEARS = 5  # Width of the age buckets in the profile index
+SAMPLE_JSONL_FILENAME = "seed_sample.jsonl"  # Output of sample mode; photo manifest goes next to it
+SERVE_PORT = 8780  # serve mode: local status/metrics/trigger endpoint (bound to 127.0.0.1)
+SERVE_INTERVAL_MINUTES = 60  # serve mode: time between scheduled incremental crawls
+PROFILE_DIRNAME = "profile"  # --profile / SIGUSR1 reports: collapsed wall-clock stacks and allocation tops
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples of the main thread
+PROFILE_TRACEMALLOC_FRAMES = 8  # Traceback depth kept per allocation
+PROFILE_TOP_ALLOCATIONS = 30  # Lines per allocation report
+PARQUET_DIRNAME = "parquet"  # Export mode writes <dir>/raw and <dir>/seed, hive-partitioned by scrape_date
+PARQUET_BATCH_SIZE = 50000  # Records converted to Arrow per record batch
+# Listing-page fields compared by refresh mode to decide whether a known profile changed
+REFRESH_LISTING_FIELDS = ('nickname_listing', 'photo_url_listing', 'gender_listing', 'age_listing', 'location_listing')
+# Popup fields convert_to_user_model reads; counters such as view_count_popup change on every fetch
+# and only update the raw record, without re-converting the user
+REFRESH_DETAIL_FIELDS = ('nickname_popup', 'age_popup', 'location_popup_he', 'gender_popup_he', 'gender_popup_en',
+                         'marital_status_popup_he', 'about_me_popup', 'general_description_popup',
+                         'iam_into_summary_popup', 'iam_looking_for_tags_popup', 'turns_me_on_tags_popup',
+                         'photo_urls_popup')
+USERNAME_REGISTRY_FILENAME = "usernames.txt"  # Append-only list of every username ever handed out
+USERNAME_MAX_BASE_LENGTH = 20  # Longer nicknames are cut before a numeric suffix is added
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "israel_localities.csv")
+GAZETTEER_CACHE_SIZE = 4096  # Distinct raw location strings remembered by resolve_location
+ABOUT_ME_CACHE_SIZE = 8192  # Distinct raw aboutMe bodies remembered by about_me_text; many are boilerplate
+SEED_PLACEHOLDER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server", "uploads", "seed")
+
+# --- Seed Field Distributions ---
+# Shared by convert_to_user_model and synth mode so both produce the same mix of values.
+PAID_TIER_PROBABILITY = 0.3  # Share of non-female, non-couple users marked PAID
+WOMAN_SEEKS_BOTH_PROBABILITY = 0.3  # Share of women looking for men and women
+ONLINE_PROBABILITY = 0.3
+DEFAULT_INTERESTS = {
+    "couple": ["Couples", "Dating", "Social", "Events"],
+    "female": ["Dating", "Fashion", "Travel", "Wine"],
+    "male": ["Dating", "Sports", "Music", "Tech"],
+}
+DEFAULT_AGE_RANGE = (25, 60)  # Used when no age was scraped
+CREATED_DAYS_AGO_RANGE = (30, 365)
+LAST_ACTIVE_HOURS_AGO_RANGE = (1, 168)
+POPUP_PHOTO_PRIVACY_OPTIONS = ["private", "public", "friends_only"]
+
+# Synth-only marginals (no scraped source to borrow from)
+SYNTH_GENDER_WEIGHTS = {"male": 0.6, "female": 0.25, "couple": 0.15}
+SYNTH_PHOTO_COUNT_WEIGHTS = [0.6, 0.2, 0.12, 0.08]  # 1..4 photos per user
+SYNTH_MARITAL_STATUSES = ["Single", "Married", "Divorced", "Widowed", "In a relationship", ""]
+SYNTH_LOCATIONS = ["תל אביב - יפו", "חיפה", "ירושלים", "פתח תקווה", "רמת גן", "אשדוד", "באר שבע", "אשקלון",
+                   "נתניה", "ראשון לציון", "חולון", "הרצליה", "רעננה", "כפר סבא", "נהריה", "עפולה"]
 
 # --- Logging Setup ---
 # Ensure OUTPUT_DIR exists before setting up FileHandler
@@ -60,6 +171,155 @@ session.headers.update({
 })
 
 
+# --- Compressed Storage ---
+# Data files are read and written through open_data_file, which picks the codec from the file
+# extension (.zst, .gz or plain), so callers always see the same parsed records.
+DATA_FILE_SUFFIXES = (".zst", ".gz", "")
+
+
+def data_file_suffix():
+    """Extension appended to data files written under the configured DATA_COMPRESSION."""
+    if DATA_COMPRESSION == "zstd" and zstandard is not None:
+        return ".zst"
+    if DATA_COMPRESSION in ("zstd", "gzip"):
+        return ".gz"
+    return ""
+
+
+def data_path(base_path):
+    """Path a writer should use for base_path (e.g. users_data_complete.json -> users_data_complete.json.zst)."""
+    return base_path + data_file_suffix()
+
+
+def find_data_file(base_path):
+    """Return the existing compressed or plain variant of base_path, preferring the configured one, or None."""
+    preferred = data_path(base_path)
+    candidates = [preferred] + [base_path + suffix for suffix in DATA_FILE_SUFFIXES if base_path + suffix != preferred]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def open_data_file(path, mode='r'):
+    """Open a UTF-8 text stream on path, compressing or decompressing on the fly by extension."""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed; install the zstandard package to use it")
+        if 'r' in mode:
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        else:
+            raw = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, mode[0] + 'b'))
+        return io.TextIOWrapper(raw, encoding='utf-8')
+    if path.endswith(".gz"):
+        return gzip.open(path, mode[0] + 't', compresslevel=GZIP_LEVEL, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def remove_data_variants(base_path, keep=None):
+    """Delete every compressed or plain variant of base_path except `keep`."""
+    for suffix in DATA_FILE_SUFFIXES:
+        variant = base_path + suffix
+        if variant != keep and os.path.exists(variant):
+            try:
+                os.remove(variant)
+            except OSError as e:
+                logging.warning(f"Could not remove stale data file {variant}: {e}")
+
+
+def load_json_data(base_path, default=None):
+    """Load JSON from whichever variant of base_path exists; returns default if none does."""
+    path = find_data_file(base_path)
+    if path is None:
+        return default
+    with open_data_file(path) as f:
+        return json.load(f)
+
+
+def save_json_data(data, base_path):
+    """
+    Stream data as JSON to base_path under the configured compression and drop stale variants.
+    Plain files stay pretty-printed; compressed ones are written compact.
+    """
+    path = data_path(base_path)
+    with open_data_file(path, 'w') as f:
+        json.dump(data, f, indent=4 if path == base_path else None, ensure_ascii=False)
+    remove_data_variants(base_path, keep=path)
+    return path
+
+
+def iter_json_records(path, chunk_size=1 << 20):
+    """
+    Yield records one at a time from a JSON array or JSONL file (compressed or plain) without
+    parsing the whole file, so memory stays bounded by the largest single record.
+    """
+    with open_data_file(path) as f:
+        if ".jsonl" in os.path.basename(path):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer, pos, started, eof = "", 0, False, False
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer):
+                if not started:
+                    if buffer[pos] != "[":
+                        raise ValueError(f"{path} does not contain a JSON array")
+                    started, pos = True, pos + 1
+                    continue
+                if buffer[pos] == "]":
+                    return
+                try:
+                    record, pos = decoder.raw_decode(buffer, pos)
+                    yield record
+                    continue
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    # The record straddles the chunk boundary; read more and decode again
+            elif eof:
+                if started:
+                    raise ValueError(f"{path} ended before the JSON array was closed")
+                return
+            chunk = f.read(chunk_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+
+
+def save_json_records(records, base_path):
+    """
+    Stream an iterable of records to base_path as a JSON array, writing to a temporary file that
+    replaces the target at the end, so records may be streamed from the file being replaced.
+    Returns (path, record_count).
+    """
+    path = data_path(base_path)
+    partial_path = base_path + ".partial" + data_file_suffix()
+    pretty = path == base_path
+    count = 0
+    with open_data_file(partial_path, 'w') as f:
+        f.write("[")
+        for record in records:
+            f.write(",\n" if count else "\n")
+            if pretty:
+                f.write("    " + json.dumps(record, indent=4, ensure_ascii=False).replace("\n", "\n    "))
+            else:
+                f.write(json.dumps(record, ensure_ascii=False))
+            count += 1
+        f.write("\n]" if count else "]")
+    os.replace(partial_path, path)
+    remove_data_variants(base_path, keep=path)
+    return path, count
+
+
+def iter_history_records(base_path):
+    """Stream the records of a stored history file, or nothing if it does not exist yet."""
+    path = find_data_file(base_path)
+    return iter_json_records(path) if path else iter(())
+
+
 # --- Helper Functions ---
 def get_safe_text(element, default_val=None):
     """Safely get text from a BeautifulSoup element, stripping whitespace."""
@@ -97,25 +357,28 @@ def determine_account_tier(gender, is_couple=False):
         return "FEMALE"
     else:
         # Randomly assign some males as PAID
-        return "PAID" if random.random() < 0.3 else "FREE"
+        return "PAID" if random.random() < PAID_TIER_PROBABILITY else "FREE"
+
+
+def set_base_url(base_url):
+    """Point the listing, details and photo URLs at another host."""
+    global BASE_URL, LISTING_URL_TEMPLATE, USER_DETAILS_AJAX_URL_TEMPLATE
+    BASE_URL = base_url.rstrip("/")
+    LISTING_URL_TEMPLATE = BASE_URL + "/online.aspx?page={page_num}&view=2"
+    USER_DETAILS_AJAX_URL_TEMPLATE = BASE_URL + "/api/getprofile?customerId={user_id}"
+    session.headers['Referer'] = BASE_URL + '/'
+    logging.info(f"Using base URL {BASE_URL}")
+
+
+def polite_sleep(low, high):
+    """Sleep a random time between low and high seconds, scaled by POLITE_DELAY_SCALE."""
+    if POLITE_DELAY_SCALE > 0:
+        time.sleep(random.uniform(low, high) * POLITE_DELAY_SCALE)
 
 
 def generate_username(nickname):
-    """Generate username from nickname."""
-    if not nickname:
-        return f"user_{random.randint(10000, 99999)}"
-    # Clean nickname - handle Hebrew characters by removing them
-    # Keep only ASCII alphanumeric characters
-    base = re.sub(r'[^a-zA-Z0-9]', '', nickname)
-    if not base:
-        # If no ASCII characters, try transliteration or use random
-        base = f"user_{random.randint(1000, 9999)}"
-    else:
-        base = base.lower()
-    # Add random number if needed
-    if random.random() < 0.5:
-        base += str(random.randint(1, 999))
-    return base
+    """Generate a username from a nickname that no earlier run or record has used."""
+    return allocate_username(username_base(nickname))
 
 
 def marital_status_hebrew_to_english(status_he):
@@ -136,6 +399,30 @@ def marital_status_hebrew_to_english(status_he):
     return mapping.get(status_he, "")
 
 
+ABOUT_ME_DROP_PATTERN = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+ABOUT_ME_TAG_PATTERN = re.compile(r"</?([a-zA-Z][a-zA-Z0-9]*)\b[^>]*>")
+ABOUT_ME_LINE_BREAK_TAGS = {"br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+
+@functools.lru_cache(maxsize=ABOUT_ME_CACHE_SIZE)
+def about_me_text(about_me_html):
+    """
+    Flatten an aboutMe HTML body to plain text: <br> and block tags become line breaks, other
+    tags are dropped, entities are decoded and runs of spaces collapse. Memoized on the body.
+    """
+    if not about_me_html:
+        return ""
+    text = about_me_html
+    if "<" in text:
+        text = ABOUT_ME_DROP_PATTERN.sub("", text)
+        text = ABOUT_ME_TAG_PATTERN.sub(
+            lambda m: "\n" if m.group(1).lower() in ABOUT_ME_LINE_BREAK_TAGS else "", text)
+    if "&" in text:
+        text = html.unescape(text)  # After tag stripping, so an escaped "&lt;b&gt;" stays literal text
+    lines = (" ".join(line.split()) for line in text.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
 def create_bio_from_about_me(about_me_text, age=None, location=None):
     """Create a bio from scraped about me text."""
     if not about_me_text:
@@ -230,6 +517,785 @@ def parse_gender_age_location_simple(text):
     return gender, age, location
 
 
+# --- Location Gazetteer ---
+# Scraped locations are free Hebrew text. They are resolved offline against the bundled localities
+# table so seed records carry a canonical city name and a GeoJSON point for a 2dsphere index.
+PLACE_NAME_SEPARATORS = re.compile(r"[\s\-\u05be\u2013\u2014_,.()]+")  # Spaces, hyphens, maqaf, dashes
+
+gazetteer = None  # normalised name or alias -> (name_he, name_en, lat, lon)
+
+
+def normalize_place_name(text):
+    """Lookup key for a place name: separators collapsed, Hebrew geresh/gershayim unified, lowercased."""
+    text = text.replace("\u05f4", '"').replace("\u05f3", "'").replace("''", '"')
+    return PLACE_NAME_SEPARATORS.sub(" ", text).strip().lower()
+
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Load the localities table, indexing each locality by its Hebrew and English names and aliases."""
+    global gazetteer
+    gazetteer = {}
+    try:
+        with open(path, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                place = (row['name_he'], row['name_en'], float(row['lat']), float(row['lon']))
+                names = [row['name_he'], row['name_en']] + [a for a in (row.get('aliases') or '').split('|') if a]
+                for name in names:
+                    gazetteer.setdefault(normalize_place_name(name), place)
+    except (OSError, KeyError, ValueError) as e:
+        logging.error(f"Could not load gazetteer {path}: {e}; locations will not be resolved")
+    resolve_location.cache_clear()
+    return gazetteer
+
+
+@functools.lru_cache(maxsize=GAZETTEER_CACHE_SIZE)
+def resolve_location(raw_location):
+    """
+    Resolve a scraped location to (name_he, name_en, lat, lon), or None if it is not a known locality.
+    Handles alias spellings and the stray "from" prefix (e.g. "מבאר שבע") left by the listing parser.
+    """
+    if gazetteer is None:
+        load_gazetteer()
+    if not raw_location or not isinstance(raw_location, str):
+        return None
+    key = normalize_place_name(raw_location)
+    if not key or key.isdigit():  # Ages sometimes land in the location slot
+        return None
+    place = gazetteer.get(key)
+    if place is None and key.startswith("מ"):
+        place = gazetteer.get(key[1:])
+    return place
+
+
+def geo_point(place):
+    """GeoJSON point for a resolved place; GeoJSON orders coordinates longitude first."""
+    return {"type": "Point", "coordinates": [place[3], place[2]]}
+
+
+# --- Username Allocation ---
+# Usernames double as the seed email local part, which the server indexes as unique. Every name
+# handed out is kept in a persistent registry, and clashes get deterministic numeric suffixes.
+HEBREW_TO_LATIN = {
+    "א": "a", "ב": "b", "ג": "g", "ד": "d", "ה": "h", "ו": "o", "ז": "z", "ח": "ch", "ט": "t", "י": "i",
+    "כ": "k", "ך": "kh", "ל": "l", "מ": "m", "ם": "m", "נ": "n", "ן": "n", "ס": "s", "ע": "a", "פ": "p",
+    "ף": "f", "צ": "ts", "ץ": "ts", "ק": "k", "ר": "r", "ש": "sh", "ת": "t",
+}
+HEBREW_WORD_INITIAL = {"ו": "v", "י": "y"}  # Consonants at the start of a word, vowels elsewhere
+HEBREW_WORD_FINAL = {"ה": "a", "י": "i"}
+
+username_registry = None  # Every allocated username
+username_registry_pending = []  # Allocated since the last flush, appended to the registry file on save
+username_next_suffix = {}  # base -> first suffix not yet known to be taken
+
+
+@functools.lru_cache(maxsize=GAZETTEER_CACHE_SIZE)
+def transliterate_hebrew(text):
+    """Rough Hebrew -> Latin transliteration for usernames ("דנה" -> "dna", "ארוך מאוד" -> "arokh maod")."""
+    words = []
+    for word in re.findall(r"[\u05d0-\u05ea]+|[A-Za-z0-9]+", text):
+        letters = []
+        for i, char in enumerate(word):
+            if i == 0 and char in HEBREW_WORD_INITIAL:
+                letters.append(HEBREW_WORD_INITIAL[char])
+            elif i == len(word) - 1 and i > 0 and char in HEBREW_WORD_FINAL:
+                letters.append(HEBREW_WORD_FINAL[char])
+            else:
+                letters.append(HEBREW_TO_LATIN.get(char, char))
+        words.append("".join(letters))
+    return " ".join(words)
+
+
+def username_base(nickname):
+    """Lowercase ASCII base for a nickname: its Latin letters and digits, transliterated if it is Hebrew."""
+    base = re.sub(r'[^a-z0-9]', '', transliterate_hebrew(nickname or "").lower())
+    base = base[:USERNAME_MAX_BASE_LENGTH]
+    if len(base) < 3 or base.isdigit():
+        base = "user" + base
+    return base
+
+
+def load_username_registry():
+    """
+    Load the registry, creating it from the stored seed records on first use so names allocated by
+    earlier versions of the scraper are never handed out again.
+    """
+    global username_registry, username_registry_pending
+    registry_path = os.path.join(OUTPUT_DIR, USERNAME_REGISTRY_FILENAME)
+    username_registry, username_registry_pending = set(), []
+    username_next_suffix.clear()
+    if os.path.exists(registry_path):
+        with open(registry_path, encoding='utf-8') as f:
+            username_registry.update(line.rstrip("\n") for line in f if line.strip())
+        logging.info(f"Loaded {len(username_registry)} allocated usernames from {registry_path}")
+        return username_registry
+
+    for base_path, field in ((os.path.join(OUTPUT_DIR, 'seed_users_with_photos.json'), 'username'),
+                             (os.path.join(OUTPUT_DIR, JSON_FILENAME), 'seed_username')):
+        try:
+            for record in iter_history_records(base_path):
+                if record.get(field):
+                    username_registry.add(record[field])
+        except Exception as e:
+            logging.error(f"Error reading usernames from {base_path}: {e}")
+    username_registry_pending = sorted(username_registry)
+    flush_username_registry()
+    logging.info(f"Created username registry with {len(username_registry)} existing usernames")
+    return username_registry
+
+
+def allocate_username(base):
+    """Return base, or base followed by the lowest free number from 2 up, and reserve it. Amortised O(1)."""
+    if username_registry is None:
+        load_username_registry()
+    username = base
+    if username in username_registry:
+        suffix = username_next_suffix.get(base, 2)
+        while f"{base}{suffix}" in username_registry:
+            suffix += 1
+        username = f"{base}{suffix}"
+        username_next_suffix[base] = suffix + 1
+    username_registry.add(username)
+    username_registry_pending.append(username)
+    return username
+
+
+def flush_username_registry():
+    """Append usernames allocated since the last flush to the registry file."""
+    global username_registry_pending
+    if not username_registry_pending:
+        return
+    registry_path = os.path.join(OUTPUT_DIR, USERNAME_REGISTRY_FILENAME)
+    try:
+        with open(registry_path, 'a', encoding='utf-8') as f:
+            f.write("".join(f"{username}\n" for username in username_registry_pending))
+        username_registry_pending = []
+    except OSError as e:
+        logging.error(f"Error saving username registry {registry_path}: {e}")
+
+
+# --- Dead-Letter Store ---
+# Every stage records its failures here with the reason and attempt count instead of dropping them,
+# so 'retry-failed' can reprocess only what failed. Entries are cleared when the stage later succeeds.
+DEAD_LETTER_STAGES = ("listing", "details", "photo", "convert")  # Also the order retry-failed uses
+
+dead_letters = {}  # "stage:user_id:key" -> entry dict
+
+
+def dead_letter_id(stage, user_id=None, key=None):
+    return f"{stage}:{user_id or ''}:{key or ''}"
+
+
+def load_dead_letters():
+    """Load the persisted dead-letter store from OUTPUT_DIR."""
+    global dead_letters
+    try:
+        entries = load_json_data(os.path.join(OUTPUT_DIR, DEAD_LETTER_FILENAME), default=[])
+    except Exception as e:
+        logging.error(f"Error loading dead-letter store: {e}")
+        entries = []
+    dead_letters = {dead_letter_id(e['stage'], e.get('user_id'), e.get('key')): e for e in entries}
+    if dead_letters:
+        logging.info(f"Loaded {len(dead_letters)} dead-letter entries")
+    return dead_letters
+
+
+def save_dead_letters():
+    try:
+        save_json_data(list(dead_letters.values()), os.path.join(OUTPUT_DIR, DEAD_LETTER_FILENAME))
+    except Exception as e:
+        logging.error(f"Error saving dead-letter store: {e}")
+
+
+def record_failure(stage, user_id=None, reason="", key=None, payload=None):
+    """Add a failure to the dead-letter store, or bump its attempt count if it is already there."""
+    entry_id = dead_letter_id(stage, user_id, key)
+    now = datetime.now().isoformat()
+    entry = dead_letters.get(entry_id)
+    if entry is None:
+        entry = dead_letters[entry_id] = {
+            'stage': stage, 'user_id': str(user_id) if user_id else None, 'key': key,
+            'attempts': 0, 'first_failed_at': now,
+        }
+    entry['attempts'] += 1
+    entry['last_failed_at'] = now
+    entry['reason'] = str(reason)
+    if payload is not None:
+        entry['payload'] = payload
+    logging.debug(f"Dead-lettered {entry_id} (attempt {entry['attempts']}): {reason}")
+
+
+def clear_failure(stage, user_id=None, key=None):
+    """Remove a dead-letter entry once its stage has succeeded."""
+    if dead_letters.pop(dead_letter_id(stage, user_id, key), None):
+        logging.info(f"Recovered dead-lettered {stage} for {user_id or key}")
+
+
+# --- Photo Manifest ---
+# In-memory index of the photos directory, built with a single os.scandir pass and persisted
+# between runs, so download_photo and convert_to_user_model never stat individual files. Each
+# (user_id, label, number) slot holds one file; a second file for a slot (another gender prefix
+# or extension after a content-type change) is stale and is deleted in favour of the newer one.
+PHOTO_FILENAME_PATTERN = re.compile(
+    r"^(?:user|woman|man|couple)_(\d+)_([\w-]+?)(?:_n(\d+))?\.(jpg|jpeg|png|gif|webp)$", re.IGNORECASE)
+
+photo_manifest = {}  # (user_id, label, number) -> {'path', 'filename', 'size', 'mtime_ns', 'digest'}
+photo_manifest_dir = None
+
+
+def photo_manifest_key(user_id, label, number):
+    """Build the manifest key for a photo; number is '' when the URL had no number= parameter."""
+    return str(user_id), label, str(number) if number else ""
+
+
+def file_digest(file_path):
+    """SHA-1 hex digest of a file, read in chunks."""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def drop_stale_photo(kept, stale):
+    """Delete the older of two files for the same manifest slot."""
+    logging.warning(f"Photos {kept['filename']} and {stale['filename']} fill the same slot; deleting the older "
+                    f"{stale['filename']}")
+    try:
+        os.remove(stale['path'])
+    except OSError as e:
+        logging.error(f"Could not delete stale photo {stale['path']}: {e}")
+
+
+def build_photo_manifest(photos_dir):
+    """
+    Index photos_dir with one os.scandir pass. Files already in the persisted manifest keep their
+    recorded size, mtime and digest without a stat (download_photo is the only writer and records
+    every file it saves); only files the manifest has not seen are stat'ed and hashed.
+    """
+    global photo_manifest, photo_manifest_dir
+    manifest_path = os.path.join(OUTPUT_DIR, PHOTO_MANIFEST_FILENAME)
+    persisted = {}
+    if find_data_file(manifest_path):
+        try:
+            persisted = load_json_data(manifest_path).get('files', {})
+        except Exception as e:
+            logging.error(f"Error loading photo manifest {manifest_path}: {e}")
+
+    manifest = {}
+    hashed_count = 0
+    if os.path.isdir(photos_dir):
+        with os.scandir(photos_dir) as it:
+            for dir_entry in it:
+                match = PHOTO_FILENAME_PATTERN.match(dir_entry.name)
+                if not match or not dir_entry.is_file():
+                    continue
+                known = persisted.get(dir_entry.name)
+                if known and known.get('digest'):
+                    size, mtime_ns, digest = known.get('size'), known.get('mtime_ns'), known['digest']
+                else:
+                    try:
+                        stat = dir_entry.stat()
+                        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+                        digest = file_digest(dir_entry.path)
+                        hashed_count += 1
+                    except OSError as e:
+                        logging.error(f"Could not hash photo {dir_entry.path}: {e}")
+                        continue
+                entry = {
+                    'path': os.path.join(photos_dir, dir_entry.name),
+                    'filename': dir_entry.name,
+                    'size': size,
+                    'mtime_ns': mtime_ns,
+                    'digest': digest,
+                }
+                key = photo_manifest_key(match.group(1), match.group(2), match.group(3))
+                other = manifest.get(key)
+                if other is not None:
+                    if (other['mtime_ns'] or 0) > (mtime_ns or 0):
+                        drop_stale_photo(other, entry)
+                        continue
+                    drop_stale_photo(entry, other)
+                manifest[key] = entry
+
+    photo_manifest = manifest
+    photo_manifest_dir = os.path.normpath(photos_dir)
+    logging.info(f"Photo manifest built for {photos_dir}: {len(manifest)} photos ({hashed_count} newly hashed)")
+    return manifest
+
+
+def ensure_photo_manifest(photos_dir):
+    """Build the manifest for photos_dir unless it is already the one loaded."""
+    if photo_manifest_dir != os.path.normpath(photos_dir):
+        build_photo_manifest(photos_dir)
+
+
+def save_photo_manifest():
+    """Persist the manifest to OUTPUT_DIR so the next run only hashes new files."""
+    manifest_path = os.path.join(OUTPUT_DIR, PHOTO_MANIFEST_FILENAME)
+    files = {entry['filename']: {'size': entry['size'], 'mtime_ns': entry['mtime_ns'], 'digest': entry['digest']}
+             for entry in photo_manifest.values()}
+    try:
+        manifest_path = save_json_data({'version': 1, 'files': files}, manifest_path)
+        logging.debug(f"Saved photo manifest with {len(files)} entries to {manifest_path}")
+    except Exception as e:
+        logging.error(f"Error saving photo manifest {manifest_path}: {e}")
+
+
+def lookup_photo(user_id, label, number, photos_dir):
+    """Return the manifest entry for a photo, or None if it has not been downloaded."""
+    ensure_photo_manifest(photos_dir)
+    return photo_manifest.get(photo_manifest_key(user_id, label, number))
+
+
+def lookup_photo_file(file_path):
+    """Return the manifest entry for a saved photo path, or None if the file is not on disk."""
+    if not file_path:
+        return None
+    match = PHOTO_FILENAME_PATTERN.match(os.path.basename(file_path))
+    if not match:
+        return None
+    ensure_photo_manifest(os.path.dirname(file_path))
+    entry = photo_manifest.get(photo_manifest_key(match.group(1), match.group(2), match.group(3)))
+    if entry and entry['filename'] == os.path.basename(file_path):
+        return entry
+    return None
+
+
+def record_photo(file_path, user_id, label, number, size, digest):
+    """Add a freshly written photo to the manifest."""
+    ensure_photo_manifest(os.path.dirname(file_path))
+    key = photo_manifest_key(user_id, label, number)
+    previous = photo_manifest.get(key)
+    if previous and previous['filename'] != os.path.basename(file_path):
+        drop_stale_photo({'filename': os.path.basename(file_path)}, previous)
+    photo_manifest[key] = {
+        'path': file_path,
+        'filename': os.path.basename(file_path),
+        'size': size,
+        'mtime_ns': os.stat(file_path).st_mtime_ns,
+        'digest': digest,
+    }
+
+
+def forget_photo(user_id, label, number):
+    """Drop a photo from the manifest after its file was deleted."""
+    photo_manifest.pop(photo_manifest_key(user_id, label, number), None)
+
+
+# --- Near-Duplicate Photos ---
+# dedupe-photos hashes every photo in the manifest with a 64-bit dHash and pHash on a process pool,
+# groups photos that are all within PHOTO_DUPLICATE_DISTANCE of each other with a BK-tree, and writes
+# the clusters plus a skip-list of redundant files. convert_to_user_model leaves skip-listed photos out, so re-encoded
+# placeholders, stock images and photos reused across profiles do not reach the seed data.
+PHASH_SIZE = 32  # Side of the reduced image the pHash DCT runs on
+PHASH_BITS_SIDE = 8  # Low-frequency block kept from the DCT: 8x8 = 64 bits
+
+photo_skip_list = set()
+photo_skip_list_mtime = None
+
+
+def reduce_image(pixels, rows, cols):
+    """Area-average a 2-D array down to rows x cols with two vectorized reduceat passes."""
+    height, width = pixels.shape
+    row_starts = (np.arange(rows) * height) // rows
+    col_starts = (np.arange(cols) * width) // cols
+    sums = np.add.reduceat(np.add.reduceat(pixels, row_starts, axis=0), col_starts, axis=1)
+    row_sizes = np.diff(np.append(row_starts, height))
+    col_sizes = np.diff(np.append(col_starts, width))
+    return sums / np.outer(row_sizes, col_sizes)
+
+
+@functools.lru_cache(maxsize=1)
+def dct_matrix(size):
+    """Orthonormal DCT-II matrix, so the 2-D transform of X is D @ X @ D.T."""
+    k = np.arange(size)[:, None]
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * np.arange(size)[None, :] + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def hash_bits(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def perceptual_hashes(file_path):
+    """(dhash, phash) of an image file as 64-bit ints, or None if it cannot be decoded. Runs in pool workers."""
+    try:
+        with Image.open(file_path) as image:
+            image.draft('L', (PHASH_SIZE * 4, PHASH_SIZE * 4))  # Lets JPEG decode at a fraction of full size
+            pixels = np.asarray(image.convert('L'), dtype=np.float64)
+    except Exception:
+        return None
+    if pixels.shape[0] < PHASH_SIZE or pixels.shape[1] < PHASH_SIZE:
+        return None
+    gradient = reduce_image(pixels, PHASH_BITS_SIDE, PHASH_BITS_SIDE + 1)
+    dhash = hash_bits(gradient[:, 1:] > gradient[:, :-1])
+    dct = dct_matrix(PHASH_SIZE)
+    low = (dct @ reduce_image(pixels, PHASH_SIZE, PHASH_SIZE) @ dct.T)[:PHASH_BITS_SIDE, :PHASH_BITS_SIDE]
+    phash = hash_bits(low > np.median(low.ravel()[1:]))  # The DC term would dominate the median
+    return dhash, phash
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def bk_tree_add(tree, key, item):
+    """Insert item under the 64-bit key into a BK-tree of [key, items, {distance: child}] nodes."""
+    if tree is None:
+        return [key, [item], {}]
+    node = tree
+    while True:
+        distance = hamming_distance(key, node[0])
+        if distance == 0:
+            node[1].append(item)
+            return tree
+        child = node[2].get(distance)
+        if child is None:
+            node[2][distance] = [key, [item], {}]
+            return tree
+        node = child
+
+
+def bk_tree_search(tree, key, radius):
+    """Items whose key is within radius of key, pruning subtrees by the triangle inequality."""
+    found = []
+    pending = [tree] if tree is not None else []
+    while pending:
+        node = pending.pop()
+        distance = hamming_distance(key, node[0])
+        if distance <= radius:
+            found.extend(node[1])
+        pending.extend(child for d, child in node[2].items() if distance - radius <= d <= distance + radius)
+    return found
+
+
+def load_photo_hashes():
+    try:
+        hashes = load_json_data(os.path.join(OUTPUT_DIR, PHOTO_HASHES_FILENAME))
+    except Exception:
+        return {}
+    return hashes.get('hashes', {}) if isinstance(hashes, dict) else {}
+
+
+def hash_photo_manifest(workers=None):
+    """
+    Perceptual hashes for every manifest photo, keyed by manifest key. Hashes are cached by file
+    digest in PHOTO_HASHES_FILENAME; only photos not seen before are decoded, on a process pool.
+    """
+    cached = load_photo_hashes()
+    entries = {key: entry for key, entry in photo_manifest.items() if entry.get('digest')}
+    pending = sorted({entry['digest']: entry['path'] for entry in entries.values()
+                      if entry['digest'] not in cached}.items())
+    if pending:
+        start_time = time.time()
+        workers = workers or os.cpu_count() or 1
+        # Workers are forked where possible: a fresh interpreter would re-run this module's setup,
+        # which truncates the log file
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            results = pool.map(perceptual_hashes, [path for _, path in pending],
+                               chunksize=max(1, len(pending) // (workers * 4)))
+            for (digest, path), result in zip(pending, results):
+                if result is None:
+                    logging.warning(f"Could not decode {path}; it is left out of duplicate detection")
+                    continue
+                cached[digest] = [f"{result[0]:016x}", f"{result[1]:016x}"]
+        logging.info(f"Hashed {len(pending)} photos with {workers} workers in {time.time() - start_time:.1f}s")
+        save_json_data({'version': 1, 'hashes': cached}, os.path.join(OUTPUT_DIR, PHOTO_HASHES_FILENAME))
+    return {key: (int(cached[entry['digest']][0], 16), int(cached[entry['digest']][1], 16))
+            for key, entry in entries.items() if entry['digest'] in cached}
+
+
+def find_duplicate_clusters(hashes, max_distance=PHOTO_DUPLICATE_DISTANCE):
+    """
+    Group manifest keys whose dHash and pHash are both within max_distance, via a pHash BK-tree.
+    Linkage is complete: a photo joins a cluster only if it is within range of every member, so a
+    chain of slightly different photos cannot merge unrelated images into one cluster. A photo that
+    qualifies for several clusters joins the largest.
+    """
+    keys = sorted(hashes)
+    cluster_of = {}
+    clusters = []
+    tree = None
+    for i, key in enumerate(keys):
+        dhash, phash = hashes[key]
+        near = Counter(cluster_of[j] for j in bk_tree_search(tree, phash, max_distance)
+                       if hamming_distance(dhash, hashes[keys[j]][0]) <= max_distance)
+        joinable = [c for c, count in near.items() if count == len(clusters[c])]
+        if joinable:
+            cluster = min(joinable, key=lambda c: (-len(clusters[c]), c))
+            clusters[cluster].append(i)
+        else:
+            cluster = len(clusters)
+            clusters.append([i])
+        cluster_of[i] = cluster
+        tree = bk_tree_add(tree, phash, i)
+    return [[keys[i] for i in members] for members in clusters if len(members) > 1]
+
+
+def dedupe_photos(max_distance=PHOTO_DUPLICATE_DISTANCE, workers=None):
+    """
+    Find near-duplicate photos and write the duplicates report and skip-list. A cluster spanning
+    PHOTO_STOCK_MIN_USERS or more users is skipped entirely; otherwise the photo of the lowest user
+    ID (listing photo first) is kept and the rest are skipped. Returns the skip-list, or None.
+    """
+    if np is None or Image is None:
+        logging.error("dedupe-photos mode requires NumPy and Pillow. Install them with 'pip install numpy pillow'.")
+        return None
+    start_time = time.time()
+    ensure_photo_manifest(os.path.join(OUTPUT_DIR, PHOTOS_SUBDIR))
+    hashes = hash_photo_manifest(workers)
+    clusters = find_duplicate_clusters(hashes, max_distance)
+
+    report, skipped = [], set()
+    for members in clusters:
+        members.sort(key=lambda key: (int(key[0]), key[1], key[2]))
+        users = sorted({key[0] for key in members}, key=int)
+        stock = len(users) >= PHOTO_STOCK_MIN_USERS
+        kept = None if stock else photo_manifest[members[0]]['filename']
+        skipped.update(photo_manifest[key]['filename'] for key in members
+                       if photo_manifest[key]['filename'] != kept)
+        report.append({
+            'reason': 'stock' if stock else ('reused' if len(users) > 1 else 'repeated'),
+            'users': users,
+            'kept': kept,
+            'photos': [{'filename': photo_manifest[key]['filename'], 'user_id': key[0],
+                        'size': photo_manifest[key]['size'],
+                        'dhash': f"{hashes[key][0]:016x}", 'phash': f"{hashes[key][1]:016x}"} for key in members],
+        })
+    report.sort(key=lambda cluster: -len(cluster['photos']))
+
+    with open(os.path.join(OUTPUT_DIR, PHOTO_DUPLICATES_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'max_distance': max_distance, 'photos_hashed': len(hashes),
+                   'clusters': report}, f, indent=2, ensure_ascii=False)
+    skip_list_path = os.path.join(OUTPUT_DIR, PHOTO_SKIP_LIST_FILENAME)
+    with open(skip_list_path + ".tmp", 'w', encoding='utf-8') as f:
+        f.writelines(f"{filename}\n" for filename in sorted(skipped))
+    os.replace(skip_list_path + ".tmp", skip_list_path)
+
+    reasons = Counter(cluster['reason'] for cluster in report)
+    logging.info(f"Dedupe: {len(hashes)} photos, {len(report)} duplicate clusters "
+                 f"({', '.join(f'{n} {reason}' for reason, n in reasons.items()) or 'none'}), "
+                 f"{len(skipped)} photos skip-listed in {time.time() - start_time:.1f}s")
+    logging.info(f"Duplicates report in {PHOTO_DUPLICATES_FILENAME}; skip-listed photos are left out of "
+                 f"every user converted from now on")
+    return skipped
+
+
+def ensure_photo_skip_list():
+    """The skip-list written by dedupe-photos, re-read whenever the file changes."""
+    global photo_skip_list, photo_skip_list_mtime
+    skip_list_path = os.path.join(OUTPUT_DIR, PHOTO_SKIP_LIST_FILENAME)
+    try:
+        mtime = os.stat(skip_list_path).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime != photo_skip_list_mtime:
+        photo_skip_list_mtime = mtime
+        photo_skip_list = set()
+        if mtime is not None:
+            with open(skip_list_path, 'r', encoding='utf-8') as f:
+                photo_skip_list = {line.strip() for line in f if line.strip()}
+    return photo_skip_list
+
+
+def seed_photo_entry(file_path):
+    """Manifest entry for a photo that may go into the seed data: on disk and not skip-listed."""
+    if file_path and os.path.basename(file_path) in ensure_photo_skip_list():
+        return None
+    return lookup_photo_file(file_path)
+
+
+# --- Profile Index ---
+# Persistent inverted index over the raw records, updated by save_outputs as records are written,
+# so the query mode answers lookups from posting sets without reading the history files.
+PROFILE_INDEX_TAG_FIELDS = {
+    "i_am": "i_am_tags_popup",
+    "looking_for": "iam_looking_for_tags_popup",
+    "turns_on": "turns_me_on_tags_popup",
+}
+PROFILE_INDEX_FIELDS = ("gender", "age", "location") + tuple(PROFILE_INDEX_TAG_FIELDS)
+PROFILE_INDEX_VERSION = 2  # Bumped when terms change; an older persisted index is rebuilt
+
+profile_index = None  # {'postings': {term: set(user_ids)}, 'usernames': {username: user_id}}
+profile_index_terms = None  # user_id -> terms, derived from the postings only when records are re-indexed
+
+
+def profile_index_term(field, value):
+    """Normalise a field value into an index term such as 'location:חיפה' or 'age:30-34'."""
+    if field == "age":
+        try:
+            low = int(value) // AGE_BUCKET_YEARS * AGE_BUCKET_YEARS
+        except (TypeError, ValueError):
+            return f"age:{str(value).strip()}"  # Already a bucket label
+        return f"age:{low}-{low + AGE_BUCKET_YEARS - 1}"
+    if field == "location":
+        place = resolve_location(value)  # Aliases and English names share the canonical city's term
+        if place:
+            return f"location:{place[0]}"
+    return f"{field}:{str(value).strip().lower()}"
+
+
+def profile_terms(record):
+    """The index terms of one raw record."""
+    terms = set()
+    gender = record.get('gender_popup_en') or record.get('gender_listing')
+    if gender:
+        terms.add(profile_index_term("gender", gender))
+    age = record.get('age_popup') or record.get('age_listing')
+    if age:
+        terms.add(profile_index_term("age", age))
+    if record.get('location_listing'):
+        terms.add(profile_index_term("location", record['location_listing']))
+    for field, source in PROFILE_INDEX_TAG_FIELDS.items():
+        for tag in record.get(source) or []:
+            if tag and tag.strip():
+                terms.add(profile_index_term(field, tag))
+    return terms
+
+
+def load_profile_index():
+    """Load the persisted index, building it from the raw history if it does not exist yet."""
+    global profile_index, profile_index_terms
+    index_path = os.path.join(OUTPUT_DIR, PROFILE_INDEX_FILENAME)
+    if find_data_file(index_path):
+        try:
+            data = load_json_data(index_path)
+            if data.get('version') != PROFILE_INDEX_VERSION:
+                raise ValueError(f"index version {data.get('version')} is not {PROFILE_INDEX_VERSION}")
+            profile_index = {'postings': {term: set(ids) for term, ids in data.get('postings', {}).items()},
+                             'usernames': data.get('usernames', {})}
+            profile_index_terms = None
+            return profile_index
+        except Exception as e:
+            logging.error(f"Error loading profile index {index_path}: {e}; rebuilding it")
+    rebuild_profile_index(iter_history_records(os.path.join(OUTPUT_DIR, JSON_FILENAME)))
+    index_seed_usernames(iter_history_records(os.path.join(OUTPUT_DIR, 'seed_users_with_photos.json')))
+    return profile_index
+
+
+def ensure_profile_index():
+    if profile_index is None:
+        load_profile_index()
+    return profile_index
+
+
+def rebuild_profile_index(records):
+    """Replace the index with one built from the given raw records."""
+    global profile_index, profile_index_terms
+    profile_index = {'postings': {}, 'usernames': {}}
+    profile_index_terms = {}
+    count = index_profiles(records)
+    logging.info(f"Built profile index over {count} records")
+    return profile_index
+
+
+def index_profiles(records):
+    """Add or update raw records in the index; a re-indexed user's old terms are removed first."""
+    global profile_index_terms
+    ensure_profile_index()
+    postings = profile_index['postings']
+    if profile_index_terms is None:
+        profile_index_terms = {}
+        for term, user_ids in postings.items():
+            for user_id in user_ids:
+                profile_index_terms.setdefault(user_id, set()).add(term)
+
+    count = 0
+    for record in records:
+        user_id = str(record.get('user_id') or '')
+        if not user_id:
+            continue
+        terms = profile_terms(record)
+        old_terms = profile_index_terms.get(user_id, set())
+        for term in old_terms - terms:
+            postings[term].discard(user_id)
+            if not postings[term]:
+                del postings[term]
+        for term in terms - old_terms:
+            postings.setdefault(term, set()).add(user_id)
+        profile_index_terms[user_id] = terms
+        if record.get('seed_username'):
+            profile_index['usernames'][record['seed_username']] = user_id
+        count += 1
+    return count
+
+
+def index_seed_usernames(seed_records):
+    """
+    Map usernames of seed records scraped before raw records carried seed_username. Those seed
+    records used the user_id as the email local part; mappings from seed_username take precedence.
+    """
+    usernames = ensure_profile_index()['usernames']
+    for record in seed_records:
+        user_id = (record.get('email') or '').split('@')[0]
+        if record.get('username') and user_id.isdigit():
+            usernames.setdefault(record['username'], user_id)
+
+
+def save_profile_index():
+    """Persist the index to OUTPUT_DIR with sorted posting lists."""
+    if profile_index is None:
+        return
+    index_path = os.path.join(OUTPUT_DIR, PROFILE_INDEX_FILENAME)
+    data = {'version': PROFILE_INDEX_VERSION, 'age_bucket_years': AGE_BUCKET_YEARS,
+            'postings': {term: sorted(ids) for term, ids in profile_index['postings'].items()},
+            'usernames': profile_index['usernames']}
+    try:
+        index_path = save_json_data(data, index_path)
+        logging.debug(f"Saved profile index with {len(data['postings'])} terms to {index_path}")
+    except Exception as e:
+        logging.error(f"Error saving profile index {index_path}: {e}")
+
+
+def query_profiles(**filters):
+    """
+    Return the sorted user IDs matching every filter, e.g. query_profiles(gender="couple",
+    location="חיפה") or query_profiles(age=34, turns_on="humor"). Ages may be numbers or bucket labels.
+    """
+    unknown = set(filters) - set(PROFILE_INDEX_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown index field(s): {', '.join(sorted(unknown))}")
+    postings = ensure_profile_index()['postings']
+    matches = sorted((postings.get(profile_index_term(field, value), set()) for field, value in filters.items()),
+                     key=len)
+    if not matches:
+        return []
+    # Intersect from the smallest posting set so the work is bounded by the rarest term
+    result = set(matches[0])
+    for user_ids in matches[1:]:
+        result &= user_ids
+    return sorted(result, key=lambda user_id: int(user_id) if user_id.isdigit() else user_id)
+
+
+def lookup_username(username):
+    """Return the user_id a seed username was converted from, or None."""
+    return ensure_profile_index()['usernames'].get(username)
+
+
+def run_query(where=None, username=None):
+    """CLI entry point: print matching user IDs (one per line) or the user_id behind a username."""
+    if username:
+        user_id = lookup_username(username)
+        print(user_id if user_id else f"No user with seed username {username!r}")
+        return user_id
+    filters = {}
+    for condition in where or []:
+        field, sep, value = condition.partition("=")
+        if not sep:
+            raise SystemExit(f"--where expects field=value, got {condition!r}")
+        filters[field.strip()] = value
+    try:
+        user_ids = query_profiles(**filters)
+    except ValueError as e:
+        raise SystemExit(f"{e}. Fields: {', '.join(PROFILE_INDEX_FIELDS)}")
+    for user_id in user_ids:
+        print(user_id)
+    logging.info(f"Query {filters} matched {len(user_ids)} users")
+    return user_ids
+
+
 # --- Core Scraping Functions ---
 def get_listing_page_html(url):
     """Fetch HTML content for listing pages (uses GET)."""
@@ -363,20 +1429,7 @@ def parse_user_details_from_json(popup_json, user_id_for_photo_context):
         # Location is not in 'me' field but could be parsed from other fields
     
     # Other fields with correct names - handle HTML and encoding
-    about_me_raw = popup_json.get('aboutMe', '')
-    if about_me_raw:
-        # Parse HTML content
-        soup = BeautifulSoup(about_me_raw, 'html.parser')
-        # Get text content directly, preserving structure
-        about_me_text = soup.get_text(separator=' ', strip=True)
-        # Clean up extra spaces and preserve paragraph breaks
-        about_me_text = re.sub(r'\s+', ' ', about_me_text)
-        about_me_text = about_me_text.replace('<br>', '\n').replace('</p><p', '</p>\n<p')
-        # Final cleanup
-        about_me_text = about_me_text.strip()
-        details['about_me_popup'] = about_me_text
-    else:
-        details['about_me_popup'] = ''
+    details['about_me_popup'] = about_me_text(popup_json.get('aboutMe') or '')
     
     details['general_description_popup'] = popup_json.get('general', '')
     
@@ -463,8 +1516,7 @@ def parse_user_details_from_popup_html(popup_html_content, user_id_for_photo_con
 
     about_me_p = soup.find('p', id='lblAboutMe')
     if about_me_p:
-        all_texts = [t.strip() for t in about_me_p.find_all(string=True, recursive=True) if t.strip()]
-        details['about_me_popup'] = "\n".join(all_texts)
+        details['about_me_popup'] = about_me_text(about_me_p.decode_contents())
 
     general_span = soup.find('span', id='lblGeneral', class_='opt')
     if general_span: details['general_description_popup'] = get_safe_text(general_span)
@@ -571,6 +1623,52 @@ def fetch_and_parse_user_details(user_id):
         return parse_user_details_from_popup_html(popup_content, user_id)
 
 
+# Leading bytes a complete file of each type must start with
+IMAGE_SIGNATURES = {
+    '.jpg': (b"\xff\xd8\xff",),
+    '.png': (b"\x89PNG\r\n\x1a\n",),
+    '.gif': (b"GIF87a", b"GIF89a"),
+    '.webp': (b"RIFF",),  # Followed by b"WEBP" at offset 8
+}
+
+
+def sniff_image_extension(head):
+    """Extension of the image type whose signature the leading bytes match, or None."""
+    for ext, signatures in IMAGE_SIGNATURES.items():
+        if head.startswith(signatures) and (ext != '.webp' or head[8:12] == b"WEBP"):
+            return ext
+    return None
+
+
+def load_photo_part(part_path, photo_url):
+    """
+    Return (bytes already downloaded, part record) for a resumable download of photo_url, or
+    (0, None) if there is nothing to resume; parts that cannot be resumed are discarded.
+    """
+    if not os.path.exists(part_path):
+        return 0, None
+    try:
+        with open(part_path + ".json", 'r', encoding='utf-8') as f:
+            part_record = json.load(f)
+        part_size = os.path.getsize(part_path)
+    except (OSError, ValueError):
+        discard_photo_part(part_path)
+        return 0, None
+    expected_length = part_record.get('expected_length')
+    if part_record.get('url') != photo_url or not expected_length or part_size >= expected_length:
+        discard_photo_part(part_path)
+        return 0, None
+    return part_size, part_record
+
+
+def discard_photo_part(part_path):
+    for path in (part_path, part_path + ".json"):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
 def download_photo(photo_url, user_id, photos_dir, photo_label="photo", gender=None):
     """Download and save user photo if URL is valid, with a label (listing, popup_1, etc.)."""
     if not photo_url or 'transparent1px.gif' in photo_url.lower():
@@ -579,7 +1677,8 @@ def download_photo(photo_url, user_id, photos_dir, photo_label="photo", gender=N
 
     try:
         photo_number_match = re.search(r"number=(\d+)", photo_url)
-        photo_num_suffix = f"_n{photo_number_match.group(1)}" if photo_number_match else ""
+        photo_number = photo_number_match.group(1) if photo_number_match else ""
+        photo_num_suffix = f"_n{photo_number}" if photo_number else ""
         safe_label = re.sub(r'[^\w-]', '', photo_label)
         
         # Determine prefix based on gender
@@ -602,26 +1701,59 @@ def download_photo(photo_url, user_id, photos_dir, photo_label="photo", gender=N
 
         file_path = os.path.join(photos_dir, photo_filename)
 
-        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+        # Common placeholder sizes in bytes
+        placeholder_sizes_bytes = [24381, 15905, 16971]  # 24.38KB, 15.9KB, and 16.97KB actual sizes
+
+        existing_photo = lookup_photo(user_id, safe_label, photo_number, photos_dir)
+        if existing_photo and existing_photo['size'] > 0:
             # Check if existing file is a placeholder
-            file_size = os.path.getsize(file_path)
-            # Common placeholder sizes in bytes
-            placeholder_sizes_bytes = [24381, 15905, 16971]  # 24.38KB, 15.9KB, and 16.97KB actual sizes
+            file_path = existing_photo['path']
+            file_size = existing_photo['size']
             
             if file_size in placeholder_sizes_bytes:
                 logging.info(f"Existing photo {file_path} is a placeholder (size: {file_size} bytes). Deleting.")
                 try:
                     os.remove(file_path)
+                    forget_photo(user_id, safe_label, photo_number)
                 except OSError as e_rem:
                     logging.error(f"Could not delete placeholder file {file_path}: {e_rem}")
                 return None
             logging.debug(f"Photo {file_path} already exists (size: {file_size} bytes). Skipping.")
+            clear_failure("photo", user_id, photo_label)
             return file_path
 
-        logging.info(f"Downloading {photo_label} for user_id {user_id} from {photo_url} to {file_path}")
-        response = session.get(photo_url, stream=True, timeout=30)
+        # The body goes to a .part file that is only renamed into place once complete, so an
+        # interrupted download never looks like a saved photo and the next attempt can resume it
+        part_path = os.path.join(photos_dir, photo_filename_base + PHOTO_PART_SUFFIX)
+        resume_from, part_record = load_photo_part(part_path, photo_url)
+        request_headers = {}
+        if resume_from:
+            request_headers['Range'] = f"bytes={resume_from}-"
+            if part_record.get('validator'):
+                request_headers['If-Range'] = part_record['validator']
+            logging.info(f"Resuming {photo_label} for user_id {user_id} from {photo_url} at byte {resume_from}")
+        else:
+            logging.info(f"Downloading {photo_label} for user_id {user_id} from {photo_url} to {file_path}")
+        response = session.get(photo_url, stream=True, timeout=30, headers=request_headers)
+        if response.status_code == 416:
+            discard_photo_part(part_path)
+            raise IOError(f"Server rejected resuming at byte {resume_from}; partial download discarded")
         response.raise_for_status()
 
+        content_range = re.match(r"bytes (\d+)-\d+/(\d+)$", response.headers.get('content-range', ''))
+        if response.status_code == 206:
+            if not content_range or int(content_range.group(1)) != resume_from:
+                discard_photo_part(part_path)
+                raise IOError(f"Unexpected Content-Range '{response.headers.get('content-range')}' "
+                              f"when resuming at byte {resume_from}; partial download discarded")
+            expected_length = int(content_range.group(2))
+        else:
+            # A full body: no part to resume, no Range support, or the photo changed (If-Range)
+            resume_from = 0
+            content_length = response.headers.get('content-length')
+            expected_length = int(content_length) if content_length and not response.headers.get(
+                'content-encoding') else None
+
         content_type = response.headers.get('content-type', '').lower()
         new_ext = extension  # Default to original/guessed extension
         if 'jpeg' in content_type or 'jpg' in content_type:
@@ -638,49 +1770,86 @@ def download_photo(photo_url, user_id, photos_dir, photo_label="photo", gender=N
             file_path = os.path.join(photos_dir, photo_filename)
             logging.debug(f"Updated photo filename to {file_path} based on content-type: {content_type}")
 
-        with open(file_path, 'wb') as f:
+        with open(part_path + ".json", 'w', encoding='utf-8') as f:
+            json.dump({'url': photo_url, 'expected_length': expected_length,
+                       'validator': response.headers.get('etag') or response.headers.get('last-modified')}, f)
+
+        # Size and digest are tracked while writing so the manifest needs no extra stat/read
+        file_size = resume_from
+        digest = hashlib.sha1()
+        with open(part_path, 'ab' if resume_from else 'wb') as f:
+            if resume_from:
+                with open(part_path, 'rb') as existing:
+                    for block in iter(lambda: existing.read(1024 * 1024), b""):
+                        digest.update(block)
             for chunk in response.iter_content(chunk_size=16384):
                 f.write(chunk)
+                file_size += len(chunk)
+                digest.update(chunk)
+
+        # Integrity: the whole body arrived and it is an image. Servers mislabel images, so the
+        # bytes decide the extension; only bodies that are no image at all (error pages) are rejected
+        if expected_length is not None and file_size != expected_length:
+            raise IOError(f"Download ended after {file_size} of {expected_length} bytes; kept for resuming")
+        if file_size:
+            with open(part_path, 'rb') as f:
+                sniffed_ext = sniff_image_extension(f.read(16))
+            if sniffed_ext is None:
+                discard_photo_part(part_path)
+                raise IOError(f"Downloaded body is not an image (content-type '{content_type}'); discarded")
+            if sniffed_ext != new_ext.replace('.jpeg', '.jpg'):
+                logging.debug(f"Photo from {photo_url} is {sniffed_ext} though served as '{content_type}'")
+                new_ext = sniffed_ext
+                file_path = os.path.join(photos_dir, photo_filename_base + new_ext)
 
-        # Check file size after download
-        file_size = os.path.getsize(file_path)
-        # Common placeholder sizes in bytes
-        placeholder_sizes_bytes = [24381, 15905, 16971]  # 24.38KB, 15.9KB, and 16.97KB actual sizes
-        
         if file_size in placeholder_sizes_bytes:
             logging.warning(f"Downloaded photo {file_path} is a placeholder (size: {file_size} bytes) for {user_id}. Deleting.")
-            try:
-                os.remove(file_path)
-            except OSError as e_rem:
-                logging.error(f"Could not delete placeholder file {file_path}: {e_rem}")
+            discard_photo_part(part_path)
             return None
         
         if file_size == 0:
             logging.warning(f"Downloaded photo {file_path} is empty for {user_id}. Deleting.")
-            try:
-                os.remove(file_path)
-            except OSError as e_rem:
-                logging.error(f"Could not delete empty file {file_path}: {e_rem}")
+            discard_photo_part(part_path)
             return None
-            
+
+        os.replace(part_path, file_path)
+        discard_photo_part(part_path)
+        record_photo(file_path, user_id, safe_label, photo_number, file_size, digest.hexdigest())
+        clear_failure("photo", user_id, photo_label)
         logging.debug(f"Successfully downloaded photo {file_path} (size: {file_size} bytes)")
         return file_path
     except requests.RequestException as e:
         logging.error(f"RequestException downloading {photo_label} for {user_id} from {photo_url}: {e}")
+        failure = e
     except IOError as e:
         logging.error(f"IOError saving {photo_label} for {user_id} (URL: {photo_url}): {e}")
+        failure = e
     except Exception as e_gen:
         logging.error(f"Generic error downloading/saving {photo_label} for {user_id} from {photo_url}: {e_gen}")
+        failure = e_gen
+    record_failure("photo", user_id, failure, key=photo_label, payload={
+        'photo_url': photo_url, 'photos_dir': photos_dir, 'photo_label': photo_label, 'gender': gender})
     return None
 
 
-def convert_to_user_model(zbeng_user_data):
-    """Convert zbeng scraped data to User model format."""
+def convert_to_user_model(zbeng_user_data, existing_seed=None):
+    """
+    Convert zbeng scraped data to User model format. When the user was exported before,
+    existing_seed is that seed record, and its account identity (username, email, password hash,
+    tier and dates) is kept so a re-conversion updates the user instead of creating another one.
+    """
     try:
         # Extract basic fields from listing
         nickname = zbeng_user_data.get('nickname_listing') or zbeng_user_data.get('nickname_popup') or f"User{random.randint(1000, 9999)}"
-        age = zbeng_user_data.get('age_listing') or zbeng_user_data.get('age_popup') or random.randint(25, 60)
-        location = zbeng_user_data.get('location_listing') or zbeng_user_data.get('location_popup_he') or "Tel Aviv"
+        age = zbeng_user_data.get('age_listing') or zbeng_user_data.get('age_popup') or random.randint(*DEFAULT_AGE_RANGE)
+        raw_location = zbeng_user_data.get('location_listing') or zbeng_user_data.get('location_popup_he')
+        place = resolve_location(raw_location)
+        if place:
+            location = place[0]
+        elif raw_location and not str(raw_location).strip().isdigit():  # Digits are a misparsed age
+            location = raw_location
+        else:
+            location = "Tel Aviv"
         
         # Convert gender
         gender_he = zbeng_user_data.get('gender_popup_he') or ""
@@ -703,16 +1872,22 @@ def convert_to_user_model(zbeng_user_data):
         # Check if couple
         is_couple = (i_am == "couple" or gender_en == "couple")
         
-        # Generate username and email
-        username = generate_username(nickname)
-        email = f"{username}@example.com"
-        
-        # Hash password
-        plain_password = "password123"
-        hashed_password = bcrypt.hashpw(plain_password.encode('utf-8'), bcrypt.gensalt(SALT_ROUNDS)).decode('utf-8')
-        
-        # Determine account tier
-        account_tier = determine_account_tier(gender_en, is_couple)
+        if existing_seed:
+            username, email = existing_seed['username'], existing_seed['email']
+            hashed_password = existing_seed['password']
+            account_tier = existing_seed.get('accountTier') or determine_account_tier(gender_en, is_couple)
+        else:
+            # Generate username and email
+            # Re-conversions (retry-failed) keep the username the user was first exported with
+            username = zbeng_user_data.get('seed_username') or generate_username(nickname)
+            email = f"{username}@example.com"
+
+            # Hash password
+            plain_password = "password123"
+            hashed_password = bcrypt.hashpw(plain_password.encode('utf-8'), bcrypt.gensalt(SALT_ROUNDS)).decode('utf-8')
+
+            # Determine account tier
+            account_tier = determine_account_tier(gender_en, is_couple)
         
         # Convert marital status
         marital_status_he = zbeng_user_data.get('marital_status_popup_he', '')
@@ -736,11 +1911,11 @@ def convert_to_user_model(zbeng_user_data):
         # If no interests found, add some defaults based on account type
         if not interests:
             if is_couple:
-                interests = ["Couples", "Dating", "Social", "Events"]
+                interests = list(DEFAULT_INTERESTS["couple"])
             elif gender_en == "female":
-                interests = ["Dating", "Fashion", "Travel", "Wine"]
+                interests = list(DEFAULT_INTERESTS["female"])
             else:
-                interests = ["Dating", "Sports", "Music", "Tech"]
+                interests = list(DEFAULT_INTERESTS["male"])
         
         # Ensure interests is a list
         if not isinstance(interests, list):
@@ -773,7 +1948,7 @@ def convert_to_user_model(zbeng_user_data):
         if i_am == "man":
             looking_for = ["women"]
         elif i_am == "woman":
-            looking_for = ["men", "women"] if random.random() < 0.3 else ["men"]
+            looking_for = ["men", "women"] if random.random() < WOMAN_SEEKS_BOTH_PROBABILITY else ["men"]
         elif i_am == "couple":
             looking_for = ["women", "couples"]
         
@@ -782,7 +1957,8 @@ def convert_to_user_model(zbeng_user_data):
         
         # Add listing photo if available
         listing_photo_file = zbeng_user_data.get('saved_listing_photo_file')
-        if listing_photo_file and os.path.exists(listing_photo_file):
+        listing_photo_entry = seed_photo_entry(listing_photo_file)
+        if listing_photo_entry:
             photos.append({
                 "url": f"/uploads/photos/{os.path.basename(listing_photo_file)}",
                 "isProfile": True,
@@ -791,7 +1967,7 @@ def convert_to_user_model(zbeng_user_data):
                 "uploadedAt": datetime.now().isoformat(),
                 "metadata": {
                     "filename": os.path.basename(listing_photo_file),
-                    "size": os.path.getsize(listing_photo_file) if os.path.exists(listing_photo_file) else 100000,
+                    "size": listing_photo_entry['size'],
                     "mimeType": "image/jpeg",
                     "width": 800,
                     "height": 800
@@ -801,12 +1977,13 @@ def convert_to_user_model(zbeng_user_data):
         # Add popup photos
         popup_photo_files = zbeng_user_data.get('saved_popup_photo_files', [])
         for idx, photo_file in enumerate(popup_photo_files):
-            if photo_file and os.path.exists(photo_file):
+            photo_entry = seed_photo_entry(photo_file)
+            if photo_entry:
                 # Skip if it's the same as listing photo
                 if photo_file == listing_photo_file:
                     continue
                     
-                privacy = "public" if idx == 0 else random.choice(["private", "public", "friends_only"])
+                privacy = "public" if idx == 0 else random.choice(POPUP_PHOTO_PRIVACY_OPTIONS)
                 photos.append({
                     "url": f"/uploads/photos/{os.path.basename(photo_file)}",
                     "isProfile": False,
@@ -815,7 +1992,7 @@ def convert_to_user_model(zbeng_user_data):
                     "uploadedAt": datetime.now().isoformat(),
                     "metadata": {
                         "filename": os.path.basename(photo_file),
-                        "size": os.path.getsize(photo_file) if os.path.exists(photo_file) else 100000,
+                        "size": photo_entry['size'],
                         "mimeType": "image/jpeg",
                         "width": 800,
                         "height": 800
@@ -840,8 +2017,15 @@ def convert_to_user_model(zbeng_user_data):
             })
         
         # Generate dates
-        created_date = datetime.now() - timedelta(days=random.randint(30, 365))
-        last_active = datetime.now() - timedelta(hours=random.randint(1, 168))
+        created_date = datetime.now() - timedelta(days=random.randint(*CREATED_DAYS_AGO_RANGE))
+        last_active = datetime.now() - timedelta(hours=random.randint(*LAST_ACTIVE_HOURS_AGO_RANGE))
+        created_at, last_active_at = created_date.isoformat(), last_active.isoformat()
+        updated_at, is_online = last_active_at, random.random() < ONLINE_PROBABILITY
+        if existing_seed:
+            created_at = existing_seed.get('createdAt') or created_at
+            last_active_at = existing_seed.get('lastActive') or last_active_at
+            updated_at = existing_seed.get('updatedAt') or updated_at
+            is_online = existing_seed.get('isOnline', is_online)
         
         # Create User model compatible object
         user_model = {
@@ -864,25 +2048,1123 @@ def convert_to_user_model(zbeng_user_data):
                 "maritalStatus": marital_status or ""
             },
             "photos": photos,
-            "isOnline": random.random() < 0.3,
-            "lastActive": last_active.isoformat(),
+            "isOnline": is_online,
+            "lastActive": last_active_at,
             "isVerified": True,
             "active": True,
-            "createdAt": created_date.isoformat(),
-            "updatedAt": last_active.isoformat(),
+            "createdAt": created_at,
+            "updatedAt": updated_at,
             "isCouple": is_couple
         }
+        if place:
+            # Only resolved localities get a point; the "Tel Aviv" fallback must not skew proximity queries
+            user_model["details"]["geo"] = geo_point(place)
         
         return user_model
         
     except Exception as e:
         logging.error(f"Error converting user to model format: {e}")
+        record_failure("convert", zbeng_user_data.get('user_id'), e)
+        return None
+
+
+# --- Seed Validation ---
+# Field rules mirrored from server/models/User.js. Lengths are counted in UTF-16 code units, as
+# Mongoose does, so nicknames and bios with emoji are measured the way the server measures them.
+USER_MODEL_SCHEMA = {
+    "email": {"type": "string", "required": True, "pattern": r"^[^@\s]+@[^@\s]+\.[^@\s]+$"},
+    "password": {"type": "string", "required": True, "minlength": 8},
+    "username": {"type": "string"},
+    "nickname": {"type": "string", "required": True, "trim": True, "minlength": 3, "maxlength": 30},
+    "role": {"type": "string", "enum": ["user", "moderator", "admin"]},
+    "accountTier": {"type": "string", "enum": ["FREE", "PAID", "FEMALE", "COUPLE"]},
+    "details.age": {"type": "number", "min": 18, "max": 120},
+    "details.gender": {"type": "string", "enum": ["male", "female", "non-binary", "other", ""]},
+    "details.location": {"type": "string", "trim": True, "maxlength": 100},
+    "details.geo.type": {"type": "string", "enum": ["Point"]},
+    # GeoJSON Point: exactly [longitude, latitude]; the 2dsphere index rejects anything else
+    "details.geo.coordinates": {"type": "array", "min_items": 2, "max_items": 2, "item_type": "number",
+                                "item_ranges": [(-180, 180), (-90, 90)]},
+    "details.bio": {"type": "string", "trim": True, "maxlength": 500},
+    "details.interests": {"type": "array", "max_items": 10, "item_type": "string"},
+    "details.iAm": {"type": "string", "enum": ["woman", "man", "couple", ""]},
+    "details.lookingFor": {"type": "array", "max_items": 3, "item_enum": ["women", "men", "couples"]},
+    "details.intoTags": {"type": "array", "max_items": 20, "item_type": "string"},
+    "details.turnOns": {"type": "array", "max_items": 20, "item_type": "string"},
+    "details.maritalStatus": {"type": "string", "enum": [
+        "Single", "Married", "Divorced", "Separated", "Widowed", "In a relationship",
+        "It's complicated", "Open relationship", "Polyamorous", ""]},
+    "photos": {"type": "array"},
+    "photos[].url": {"type": "string", "required": True},
+    "photos[].privacy": {"type": "string", "required": True, "enum": ["public", "private", "friends_only"]},
+    "photos[].isProfile": {"type": "boolean"},
+    "photos[].isDeleted": {"type": "boolean"},
+    "isOnline": {"type": "boolean"},
+    "isVerified": {"type": "boolean"},
+    "active": {"type": "boolean"},
+    "isCouple": {"type": "boolean"},
+    "lastActive": {"type": "date"},
+    "createdAt": {"type": "date"},
+    "updatedAt": {"type": "date"},
+}
+
+_MISSING = object()
+seed_validator = None  # Compiled lazily from USER_MODEL_SCHEMA by get_seed_validator
+
+
+def js_length(text):
+    """String length as JavaScript reports it (UTF-16 code units)."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def is_iso_date(value):
+    try:
+        datetime.fromisoformat(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def compile_field_check(spec):
+    """Turn one schema spec into a function returning an error code for a value, or None if valid."""
+    type_checks = {
+        "string": lambda v: isinstance(v, str),
+        "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+        "boolean": lambda v: isinstance(v, bool),
+        "array": lambda v: isinstance(v, list),
+        "date": lambda v: isinstance(v, str) and is_iso_date(v),
+    }
+    checks = [("type", type_checks[spec["type"]])]
+    if "enum" in spec:
+        allowed = frozenset(spec["enum"])
+        checks.append(("enum", lambda v: v in allowed))
+    if "pattern" in spec:
+        pattern = re.compile(spec["pattern"])
+        checks.append(("pattern", lambda v: pattern.match(v) is not None))
+    trim = spec.get("trim", False)
+    if "minlength" in spec:
+        minlength = spec["minlength"]
+        checks.append(("minlength", lambda v: js_length(v.strip() if trim else v) >= minlength))
+    if "maxlength" in spec:
+        maxlength = spec["maxlength"]
+        checks.append(("maxlength", lambda v: js_length(v.strip() if trim else v) <= maxlength))
+    if "min" in spec:
+        checks.append(("min", lambda v: v >= spec["min"]))
+    if "max" in spec:
+        checks.append(("max", lambda v: v <= spec["max"]))
+    if "min_items" in spec:
+        checks.append(("min_items", lambda v: len(v) >= spec["min_items"]))
+    if "max_items" in spec:
+        checks.append(("max_items", lambda v: len(v) <= spec["max_items"]))
+    if "item_type" in spec:
+        item_check = type_checks[spec["item_type"]]
+        checks.append(("item_type", lambda v: all(item_check(item) for item in v)))
+    if "item_ranges" in spec:
+        item_ranges = spec["item_ranges"]
+        checks.append(("item_range", lambda v: all(low <= item <= high for item, (low, high) in zip(v, item_ranges))))
+    if "item_enum" in spec:
+        allowed_items = frozenset(spec["item_enum"])
+        checks.append(("item_enum", lambda v: all(item in allowed_items for item in v)))
+    required = spec.get("required", False)
+
+    def check(value):
+        if value is _MISSING or value is None:
+            return "required" if required else None
+        for code, predicate in checks:
+            if not predicate(value):
+                return code
+        return None
+    return check
+
+
+def compile_field_getter(field):
+    """Return a function fetching a dotted field from a record; 'photos[].url' yields one value per photo."""
+    array_path, _, item_path = field.partition("[].")
+    keys = array_path.split(".")
+
+    # Fields are at most two levels deep; specialise those so the hot path is plain dict lookups
+    if len(keys) == 1:
+        def get(record):
+            return record.get(keys[0], _MISSING)
+    elif len(keys) == 2:
+        def get(record):
+            parent = record.get(keys[0])
+            return parent.get(keys[1], _MISSING) if isinstance(parent, dict) else _MISSING
+    else:
+        def get(record):
+            value = record
+            for key in keys:
+                value = value.get(key, _MISSING) if isinstance(value, dict) else _MISSING
+                if value is _MISSING:
+                    break
+            return value
+
+    if not item_path:
+        return lambda record: (get(record),)
+
+    def get_items(record):
+        items = get(record)
+        if not isinstance(items, list):
+            return ()
+        return [item.get(item_path, _MISSING) if isinstance(item, dict) else _MISSING for item in items]
+    return get_items
+
+
+def compile_seed_validator(schema=USER_MODEL_SCHEMA):
+    """Compile the schema description into a flat list of (field, getter, check) triples."""
+    return [(field, compile_field_getter(field), compile_field_check(spec)) for field, spec in schema.items()]
+
+
+def get_seed_validator():
+    global seed_validator
+    if seed_validator is None:
+        seed_validator = compile_seed_validator()
+    return seed_validator
+
+
+def validate_seed_records(records, error_counts=None):
+    """
+    Check a batch of seed records against the User model. Returns (valid_records, rejects, error_counts)
+    where each reject is {"errors": [...], "record": record} and error_counts is keyed "field:code".
+    """
+    validator = get_seed_validator()
+    error_counts = error_counts if error_counts is not None else Counter()
+    valid_records, rejects = [], []
+    for record in records:
+        if not isinstance(record, dict):
+            error_counts["record:type"] += 1
+            rejects.append({"errors": ["record:type"], "record": record})
+            continue
+        errors = []
+        for field, getter, check in validator:
+            for value in getter(record):
+                code = check(value)
+                if code:
+                    errors.append(f"{field}:{code}")
+                    break
+        if errors:
+            error_counts.update(errors)
+            rejects.append({"errors": errors, "record": record})
+        else:
+            valid_records.append(record)
+    return valid_records, rejects, error_counts
+
+
+def write_seed_rejects(rejects, rejects_path=None, mode='w'):
+    """Write rejected seed records with their errors as JSON lines."""
+    rejects_path = rejects_path or data_path(os.path.join(OUTPUT_DIR, SEED_REJECTS_FILENAME))
+    with open_data_file(rejects_path, mode) as f:
+        for reject in rejects:
+            f.write(json.dumps(reject, ensure_ascii=False))
+            f.write("\n")
+    return rejects_path
+
+
+def log_validation_summary(valid_count, reject_count, error_counts):
+    logging.info(f"Seed validation: {valid_count} valid, {reject_count} rejected")
+    for field_error, count in error_counts.most_common():
+        logging.info(f"  {field_error}: {count}")
+
+
+def iter_seed_record_batches(path, batch_size=SYNTH_CHUNK_SIZE):
+    """Yield lists of seed records from a JSON array file or a JSONL file (compressed or plain)."""
+    with open_data_file(path) as f:
+        if ".jsonl" not in os.path.basename(path):
+            records = json.load(f)
+            for i in range(0, len(records), batch_size):
+                yield records[i:i + batch_size]
+            return
+        batch = []
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def validate_seed_file(path=None):
+    """Validate a stored seed file in batches, writing rejects next to it and logging per-field error counts."""
+    path = path or find_data_file(os.path.join(OUTPUT_DIR, 'seed_users_with_photos.json'))
+    if not path or not os.path.exists(path):
+        logging.error(f"Seed file to validate not found: {path}")
+        return None
+    error_counts = Counter()
+    valid_count = reject_count = 0
+    rejects_path = data_path(os.path.join(OUTPUT_DIR, SEED_REJECTS_FILENAME))
+    remove_data_variants(os.path.join(OUTPUT_DIR, SEED_REJECTS_FILENAME))
+    for batch in iter_seed_record_batches(path):
+        valid_records, rejects, error_counts = validate_seed_records(batch, error_counts)
+        valid_count += len(valid_records)
+        reject_count += len(rejects)
+        if rejects:
+            write_seed_rejects(rejects, rejects_path, mode='a')
+    log_validation_summary(valid_count, reject_count, error_counts)
+    if reject_count:
+        logging.info(f"Rejected seed records written to {rejects_path}")
+    return error_counts
+
+
+# --- Synthetic Seed Generation ---
+def load_seed_placeholders(placeholder_dir=SEED_PLACEHOLDER_DIR):
+    """List the server's placeholder images as (filename, size, mime type), falling back to placeholder_1.jpg."""
+    placeholders = []
+    if os.path.isdir(placeholder_dir):
+        with os.scandir(placeholder_dir) as it:
+            for dir_entry in it:
+                ext_match = re.search(r'\.(jpg|jpeg|png|gif|webp)$', dir_entry.name, re.IGNORECASE)
+                if ext_match and dir_entry.is_file():
+                    ext = ext_match.group(1).lower()
+                    mime_type = "image/jpeg" if ext in ("jpg", "jpeg") else f"image/{ext}"
+                    placeholders.append((dir_entry.name, dir_entry.stat().st_size, mime_type))
+    if not placeholders:
+        logging.warning(f"No placeholder images found in {placeholder_dir}. Using placeholder_1.jpg only.")
+        placeholders.append(("placeholder_1.jpg", 50000, "image/jpeg"))
+    return sorted(placeholders)
+
+
+def generate_synthetic_chunk(rng, start_index, count, now, password_hash, placeholders):
+    """
+    Generate `count` synthetic seed users as JSON lines. Every random field is sampled for the whole
+    chunk at once with NumPy; the per-user loop only stitches pre-encoded JSON fragments together.
+    """
+    genders = list(SYNTH_GENDER_WEIGHTS)
+    gender_idx = rng.choice(len(genders), size=count, p=list(SYNTH_GENDER_WEIGHTS.values()))
+    ages = rng.integers(DEFAULT_AGE_RANGE[0], DEFAULT_AGE_RANGE[1] + 1, size=count)
+    is_paid = rng.random(count) < PAID_TIER_PROBABILITY
+    seeks_both = rng.random(count) < WOMAN_SEEKS_BOTH_PROBABILITY
+    is_online = rng.random(count) < ONLINE_PROBABILITY
+    location_idx = rng.integers(0, len(SYNTH_LOCATIONS), size=count)
+    marital_idx = rng.integers(0, len(SYNTH_MARITAL_STATUSES), size=count)
+    photo_counts = rng.choice(len(SYNTH_PHOTO_COUNT_WEIGHTS), size=count, p=SYNTH_PHOTO_COUNT_WEIGHTS) + 1
+    photo_idx = rng.integers(0, len(placeholders), size=(count, len(SYNTH_PHOTO_COUNT_WEIGHTS)))
+    privacy_idx = rng.integers(0, len(POPUP_PHOTO_PRIVACY_OPTIONS), size=(count, len(SYNTH_PHOTO_COUNT_WEIGHTS)))
+
+    now64 = np.datetime64(now, 'us')
+    created_days = rng.integers(CREATED_DAYS_AGO_RANGE[0], CREATED_DAYS_AGO_RANGE[1] + 1, size=count)
+    active_hours = rng.integers(LAST_ACTIVE_HOURS_AGO_RANGE[0], LAST_ACTIVE_HOURS_AGO_RANGE[1] + 1, size=count)
+    created_at = np.datetime_as_string(now64 - created_days.astype('timedelta64[D]'), unit='us')
+    last_active = np.datetime_as_string(now64 - active_hours.astype('timedelta64[h]'), unit='us')
+
+    # Same rules as determine_account_tier and the looking_for logic in convert_to_user_model
+    tiers = np.where(gender_idx == genders.index("couple"), "COUPLE",
+                     np.where(gender_idx == genders.index("female"), "FEMALE",
+                              np.where(is_paid, "PAID", "FREE")))
+    looking_for_options = {
+        "male": [json.dumps(["women"])] * 2,
+        "female": [json.dumps(["men"]), json.dumps(["men", "women"])],
+        "couple": [json.dumps(["women", "couples"])] * 2,
+    }
+    gender_fields = {
+        "male": ('"male"', '"man"', "false"),
+        "female": ('"female"', '"woman"', "false"),
+        "couple": ('"other"', '"couple"', "true"),
+    }
+    interests_json = {g: json.dumps(DEFAULT_INTERESTS[g]) for g in genders}
+    location_fields_json = []
+    for loc in SYNTH_LOCATIONS:
+        place = resolve_location(loc)
+        fields = f'"location": {json.dumps(place[0] if place else loc, ensure_ascii=False)}'
+        if place:
+            fields += f', "geo": {json.dumps(geo_point(place))}'
+        location_fields_json.append(fields)
+    marital_json = [json.dumps(status) for status in SYNTH_MARITAL_STATUSES]
+    photo_templates = [
+        '{"url": "/uploads/seed/%s", "isProfile": %%s, "privacy": "%%s", "isDeleted": false, "uploadedAt": "%%s", '
+        '"metadata": {"filename": "%s", "size": %d, "mimeType": "%s", "width": 800, "height": 800}}'
+        % (name, name, size, mime_type) for name, size, mime_type in placeholders
+    ]
+    password_json = json.dumps(password_hash)
+
+    # Plain Python lists index much faster than NumPy scalars inside the per-user loop
+    gender_idx, ages, seeks_both, is_online = gender_idx.tolist(), ages.tolist(), seeks_both.tolist(), is_online.tolist()
+    location_idx, marital_idx, photo_counts = location_idx.tolist(), marital_idx.tolist(), photo_counts.tolist()
+    photo_idx, privacy_idx, tiers = photo_idx.tolist(), privacy_idx.tolist(), tiers.tolist()
+    created_at, last_active = created_at.tolist(), last_active.tolist()
+
+    lines = []
+    for i in range(count):
+        gender = genders[gender_idx[i]]
+        user_number = start_index + i
+        username = f"synth_user_{user_number:07d}"
+        age = ages[i]
+        location = SYNTH_LOCATIONS[location_idx[i]]
+        gender_json, i_am_json, is_couple_json = gender_fields[gender]
+        photos = []
+        for slot in range(photo_counts[i]):
+            privacy = "public" if slot < 2 else POPUP_PHOTO_PRIVACY_OPTIONS[privacy_idx[i][slot]]
+            photos.append(photo_templates[photo_idx[i][slot]] % (
+                "true" if slot == 0 else "false", privacy, created_at[i]))
+        bio = create_bio_from_about_me(None, age, location)
+        lines.append(
+            f'{{"email": "{username}@example.com", "password": {password_json}, "username": "{username}", '
+            f'"nickname": "Synth{user_number}", "role": "user", "accountTier": "{tiers[i]}", '
+            f'"details": {{"age": {age}, "gender": {gender_json}, {location_fields_json[location_idx[i]]}, '
+            f'"bio": {json.dumps(bio, ensure_ascii=False)}, "interests": {interests_json[gender]}, '
+            f'"iAm": {i_am_json}, "lookingFor": {looking_for_options[gender][seeks_both[i]]}, '
+            f'"intoTags": [], "turnOns": [], "maritalStatus": {marital_json[marital_idx[i]]}}}, '
+            f'"photos": [{", ".join(photos)}], "isOnline": {"true" if is_online[i] else "false"}, '
+            f'"lastActive": "{last_active[i]}", "isVerified": true, "active": true, '
+            f'"createdAt": "{created_at[i]}", "updatedAt": "{last_active[i]}", "isCouple": {is_couple_json}}}'
+        )
+    return lines
+
+
+def iter_synthetic_lines(total_users, chunk_size=SYNTH_CHUNK_SIZE, seed=None):
+    """Yield `total_users` synthetic seed users as JSON lines, generated chunk by chunk."""
+    rng = np.random.default_rng(seed)
+    now = datetime.now()
+    # One bcrypt hash shared by every synthetic user; hashing per user would dominate the run
+    password_hash = bcrypt.hashpw("password123".encode('utf-8'), bcrypt.gensalt(SALT_ROUNDS)).decode('utf-8')
+    placeholders = load_seed_placeholders()
+
+    generated = 0
+    while generated < total_users:
+        count = min(chunk_size, total_users - generated)
+        yield from generate_synthetic_chunk(rng, generated, count, now, password_hash, placeholders)
+        generated += count
+        logging.info(f"Synth: generated {generated}/{total_users} users")
+
+
+def generate_synthetic_seed(total_users, output_path=None, chunk_size=SYNTH_CHUNK_SIZE, seed=None,
+                            shard_bytes=None):
+    """
+    Generate `total_users` synthetic seed users fully offline and stream them to JSONL in chunks.
+    Uses the placeholder images in server/uploads/seed and contains no scraped profile data.
+    With shard_bytes set, output_path is a directory of size-bounded shards plus a manifest.
+    """
+    if np is None:
+        logging.error("Synth mode requires NumPy. Install it with 'pip install numpy'.")
+        return None
+    if total_users <= 0 or chunk_size <= 0:
+        logging.error(f"Synth needs a positive count and chunk size (got {total_users} and {chunk_size}).")
+        return None
+
+    start_time = time.time()
+    lines = iter_synthetic_lines(total_users, chunk_size, seed)
+    if shard_bytes:
+        output_path = output_path or os.path.join(OUTPUT_DIR, SYNTH_SHARD_DIRNAME)
+        write_seed_shards(lines, output_path, shard_bytes)
+    else:
+        output_path = output_path or data_path(os.path.join(OUTPUT_DIR, SYNTH_JSONL_FILENAME))
+        with open_data_file(output_path, 'w') as f:
+            for line in lines:
+                f.write(line)
+                f.write("\n")
+    logging.info(f"Synth: wrote {total_users} users to {output_path} in {time.time() - start_time:.1f}s")
+    return output_path
+
+
+# --- Seed Shards ---
+SEED_SHARD_PATTERN = re.compile(r"^seed-(?:\d{20}-)?\d{5}\.jsonl(\.zst|\.gz)?$")
+
+
+def load_seed_shard_manifest(shard_dir):
+    """The manifest of a shard directory, or None if there is none or it cannot be read."""
+    try:
+        with open(os.path.join(shard_dir, SEED_SHARD_MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) and isinstance(manifest.get('shards'), list) else None
+
+
+def write_seed_shards(json_lines, shard_dir, max_shard_bytes=SEED_SHARD_MAX_BYTES):
+    """
+    Write JSON lines into size-bounded JSONL shards (seed-<generation>-00000.jsonl, ...) plus a
+    manifest with per-shard record counts, byte sizes and SHA-256 checksums, so loaders can consume
+    shards in parallel and retry a failed shard on its own. Shards split at the previous manifest's
+    record counts while they fit, and a shard whose records are unchanged keeps its file, so a save
+    that appends or updates a few users rewrites only the shards holding them. Changed shards are
+    written under a new generation next to the old files, then the manifest is atomically replaced,
+    and only then are files it no longer lists deleted, so a crash at any point leaves a manifest
+    whose shards all exist. Shards are compressed per DATA_COMPRESSION; bytes and sha256 describe
+    the decoded JSONL.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    generation = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    previous = load_seed_shard_manifest(shard_dir)
+    previous_shards = []
+    if previous and previous.get('max_shard_bytes') == max_shard_bytes:
+        previous_shards = [s for s in previous['shards'] if isinstance(s, dict)]
+
+    shards, written = [], []
+    buffer, shard = [], None
+
+    def flush():
+        """Keep the previous file for an identical shard, otherwise write the buffered lines."""
+        data = "".join(buffer)
+        shard['sha256'] = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        old = previous_shards[len(shards) - 1] if len(shards) <= len(previous_shards) else None
+        if (old and all(old.get(k) == shard[k] for k in ('records', 'bytes', 'sha256'))
+                and old.get('file', '').endswith(".jsonl" + data_file_suffix())
+                and os.path.exists(os.path.join(shard_dir, old['file']))):
+            shard.update(file=old['file'], stored_bytes=old.get('stored_bytes'))
+            return
+        shard['file'] = data_path(f"seed-{generation}-{len(shards) - 1:05d}.jsonl")
+        written.append(shard['file'])
+        with open_data_file(os.path.join(shard_dir, shard['file']), 'w') as f:
+            f.write(data)
+        shard['stored_bytes'] = os.path.getsize(os.path.join(shard_dir, shard['file']))
+
+    try:
+        for line in json_lines:
+            data = line + "\n"
+            data_bytes = len(data.encode('utf-8'))
+            if shard is not None and shard['records']:
+                # The previous last shard has no fixed boundary, so appended users fill it up first
+                boundary = previous_shards[len(shards) - 1].get('records') if len(shards) < len(previous_shards) else None
+                # A single record larger than the bound still gets a shard of its own
+                if shard['bytes'] + data_bytes > max_shard_bytes or shard['records'] == boundary:
+                    flush()
+                    shard = None
+            if shard is None:
+                shard = {'records': 0, 'bytes': 0}
+                shards.append(shard)
+                buffer = []
+            buffer.append(data)
+            shard['records'] += 1
+            shard['bytes'] += data_bytes
+        if shard is not None:
+            flush()
+    except BaseException:
+        for name in written:  # The old manifest and the shards it lists stay in place
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(shard_dir, name))
+        raise
+
+    manifest = {
+        'version': 1,
+        'generation': generation,
+        'format': 'jsonl',
+        'compression': {'.zst': 'zstd', '.gz': 'gzip'}.get(data_file_suffix(), 'none'),
+        'created_at': datetime.now().isoformat(),
+        'max_shard_bytes': max_shard_bytes,
+        'total_records': sum(s['records'] for s in shards),
+        'shards': [{'file': s['file'], 'records': s['records'], 'bytes': s['bytes'], 'sha256': s['sha256'],
+                    'stored_bytes': s['stored_bytes']} for s in shards],
+    }
+    manifest_path = os.path.join(shard_dir, SEED_SHARD_MANIFEST_FILENAME)
+    with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    current = {s['file'] for s in shards}
+    for name in os.listdir(shard_dir):
+        if SEED_SHARD_PATTERN.match(name) and name not in current:
+            os.remove(os.path.join(shard_dir, name))
+    logging.info(f"Wrote {manifest['total_records']} seed records in {len(shards)} shard(s) to {shard_dir} "
+                 f"({len(written)} rewritten)")
+    return manifest
+
+
+# --- Stratified Sampling ---
+# Draws exactly N seed users whose gender / tier / age band / city mix matches requested
+# marginals. Pass one reads only the stratification columns, from a column cache kept next to the
+# store (<store>.columns.npz) that is rebuilt when the store changes, with a pyarrow columnar read
+# of JSONL stores. Pass two streams the store again and decodes only the chosen records, so memory
+# does not grow with the store.
+SAMPLE_DIMENSIONS = {"gender": "details.iAm", "tier": "accountTier", "age": "details.age", "city": "details.location"}
+SAMPLE_COLUMNS_SUFFIX = ".columns.npz"
+SAMPLE_COLUMNS_VERSION = 1
+SAMPLE_AGE_BANDS = ((18, 24), (25, 34), (35, 44), (45, 54), (55, 120))
+SAMPLE_OTHER = "other"  # Category covering values not named in a mix whose shares sum below 1
+SAMPLE_IPF_ITERATIONS = 200
+
+
+def sample_age_band(age):
+    if not isinstance(age, (int, float)) or isinstance(age, bool):
+        return None
+    for low, high in SAMPLE_AGE_BANDS:
+        if low <= age <= high:
+            return f"{low}+" if high >= 120 else f"{low}-{high}"
+    return None
+
+
+def parse_sample_mix(specs):
+    """Parse ["gender=man:0.6,woman:0.25,couple:0.15", ...] into {dimension: {category: share}}."""
+    mix = {}
+    for spec in specs or []:
+        dimension, sep, shares = spec.partition("=")
+        dimension = dimension.strip()
+        if not sep or dimension not in SAMPLE_DIMENSIONS:
+            raise ValueError(f"--mix expects one of {', '.join(SAMPLE_DIMENSIONS)}=value:share,..., got {spec!r}")
+        categories = {}
+        for item in shares.split(","):
+            value, _, share = item.rpartition(":")
+            if dimension == "city":
+                place = resolve_location(value.strip())
+                value = place[0] if place else value
+            categories[value.strip()] = float(share)
+        total = sum(categories.values())
+        if total <= 0:
+            raise ValueError(f"--mix for {dimension} has no positive shares")
+        if total < 1 - 1e-9:
+            categories[SAMPLE_OTHER] = categories.get(SAMPLE_OTHER, 0) + 1 - total
+        mix[dimension] = {value: share / max(total, 1.0) for value, share in categories.items()}
+    return mix
+
+
+def store_signature(path):
+    stat = os.stat(path)
+    return [SAMPLE_COLUMNS_VERSION, stat.st_size, stat.st_mtime_ns]
+
+
+def read_store_columns_arrow(path):
+    """
+    The SAMPLE_DIMENSIONS columns of a JSONL store as {dimension: Python list}, via a pyarrow
+    columnar read that skips every other field. None when pyarrow is missing or cannot read the
+    store (JSON arrays, values of an unexpected type).
+    """
+    if pa is None or ".jsonl" not in os.path.basename(path):
+        return None
+    schema = pa.schema([("accountTier", pa.string()), ("details", pa.struct(
+        [("iAm", pa.string()), ("age", pa.int64()), ("location", pa.string())]))])
+    try:
+        with pa.input_stream(path, compression='detect') as stream:
+            table = pajson.read_json(stream, parse_options=pajson.ParseOptions(
+                explicit_schema=schema, unexpected_field_behavior='ignore'))
+    except (pa.ArrowException, OSError) as e:
+        logging.info(f"Columnar read of {path} failed ({e}); reading its records instead")
+        return None
+    details = table.column("details").combine_chunks()
+    columns = {"tier": table.column("accountTier")}
+    for dimension, field in (("gender", "iAm"), ("age", "age"), ("city", "location")):
+        columns[dimension] = details.field(field)
+    return {dimension: column.to_pylist() for dimension, column in columns.items()}
+
+
+def read_store_columns_records(path):
+    """The SAMPLE_DIMENSIONS columns of any store, by decoding every record."""
+    getters = {dimension: compile_field_getter(source) for dimension, source in SAMPLE_DIMENSIONS.items()}
+    columns = {dimension: [] for dimension in SAMPLE_DIMENSIONS}
+    for record in iter_json_records(path):
+        for dimension, get in getters.items():
+            value = get(record)[0]
+            columns[dimension].append(None if value is _MISSING else value)
+    return columns
+
+
+def load_sample_columns(path):
+    """
+    {dimension: (values, codes)} for the store at path: the distinct raw values of each
+    SAMPLE_DIMENSIONS column and an int32 code per record (-1 for a missing value). Served from
+    the column cache while the store is unchanged; otherwise read and cached again.
+    """
+    cache_path = path + SAMPLE_COLUMNS_SUFFIX
+    signature = store_signature(path)
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if json.loads(str(cache['signature'])) == signature:
+                return {dimension: (json.loads(str(cache[f"{dimension}_values"])), cache[f"{dimension}_codes"])
+                        for dimension in SAMPLE_DIMENSIONS}
+    except (OSError, KeyError, ValueError):
+        pass
+
+    start_time = time.time()
+    raw_columns = read_store_columns_arrow(path) or read_store_columns_records(path)
+    columns, arrays = {}, {'signature': np.array(json.dumps(signature))}
+    for dimension, column in raw_columns.items():
+        value_codes = {}
+        codes = np.fromiter((-1 if value is None else value_codes.setdefault(value, len(value_codes))
+                             for value in column), dtype=np.int32, count=len(column))
+        columns[dimension] = (list(value_codes), codes)
+        arrays[f"{dimension}_values"] = np.array(json.dumps(list(value_codes), ensure_ascii=False))
+        arrays[f"{dimension}_codes"] = codes
+    try:
+        with open(cache_path + ".tmp", 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError as e:
+        logging.warning(f"Could not write the sample column cache {cache_path}: {e}")
+    logging.info(f"Sample: read the stratification columns of {path} in {time.time() - start_time:.1f}s")
+    return columns
+
+
+def read_sample_strata(path, mix):
+    """Pass one: the stratum (joint category) index of every record, -1 for records no stratum admits."""
+    columns = load_sample_columns(path)
+    strata = None
+    for dimension, categories in mix.items():
+        lookup = {value: i for i, value in enumerate(categories)}
+        other = lookup.get(SAMPLE_OTHER, -1)
+        values, codes = columns[dimension]
+        # Category of each distinct value; the extra last entry is the one for missing values (code -1)
+        mapped = []
+        for value in values + [None]:
+            if dimension == "age":
+                value = sample_age_band(value)
+            elif dimension == "city" and isinstance(value, str):
+                place = resolve_location(value)
+                value = place[0] if place else value
+            mapped.append(lookup.get(value, other))
+        dimension_strata = np.array(mapped, dtype=np.int64)[codes]
+        if strata is None:
+            strata = dimension_strata
+        else:
+            strata = np.where((strata < 0) | (dimension_strata < 0), -1, strata * len(categories) + dimension_strata)
+    if strata is None:
+        return np.zeros(len(next(iter(columns.values()))[1]), dtype=np.int64)
+    return strata
+
+
+def iter_selected_records(path, selected):
+    """
+    Pass two: yield the records whose index is set in selected, in store order. JSONL stores
+    decode only the selected lines; JSON array stores are decoded in full.
+    """
+    if ".jsonl" not in os.path.basename(path):
+        for index, record in enumerate(iter_json_records(path)):
+            if selected[index]:
+                yield record
+        return
+    index = 0
+    with open_data_file(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if selected[index]:
+                yield json.loads(line)
+            index += 1
+    if index != len(selected):
+        raise ValueError(f"{path} holds {index} records but its column cache has {len(selected)}")
+
+
+def allocate_sample_counts(available, mix, total):
+    """
+    Integer users per stratum summing to total (or to everything available), with marginals fitted
+    to the mix by iterative proportional fitting from the store's own joint distribution, so
+    correlations between dimensions in the data are kept. Strata are capped at what is available.
+    """
+    shape = available.shape
+    targets = [np.array(list(mix[d].values())) * total for d in mix]
+    weights = available.astype(np.float64)
+    for _ in range(SAMPLE_IPF_ITERATIONS):
+        for axis, target in enumerate(targets):
+            other_axes = tuple(a for a in range(len(shape)) if a != axis)
+            current = weights.sum(axis=other_axes)
+            factor = np.divide(target, current, out=np.zeros_like(target), where=current > 0)
+            weights *= factor.reshape([-1 if a == axis else 1 for a in range(len(shape))])
+        weights = np.minimum(weights, available)
+
+    # Largest remainder, never past a stratum's capacity
+    total = min(total, int(available.sum()))
+    counts = np.minimum(np.floor(weights).astype(np.int64), available)
+    remainders = (weights - counts).ravel()
+    flat_counts, flat_available = counts.ravel(), available.ravel()
+    for index in np.argsort(-remainders, kind="stable"):
+        if flat_counts.sum() >= total:
+            break
+        if flat_counts[index] < flat_available[index]:
+            flat_counts[index] += 1
+    # Fitting can leave too few users when the mix asks for more than some strata hold; top up
+    # from the strata with the most spare users
+    while flat_counts.sum() < total:
+        spare = flat_available - flat_counts
+        flat_counts[int(np.argmax(spare))] += 1
+    return flat_counts.reshape(shape)
+
+
+def write_sample_photo_manifest(records, manifest_path):
+    """Photo files referenced by the sampled users, with size and digest when the photo is on disk."""
+    photos_dir = os.path.join(OUTPUT_DIR, PHOTOS_SUBDIR)
+    files = {}
+    for record in records:
+        for photo in record.get('photos') or []:
+            url = photo.get('url') or ''
+            if url in files:
+                continue
+            entry = lookup_photo_file(os.path.join(photos_dir, os.path.basename(url))) \
+                if url.startswith('/uploads/photos/') else None
+            files[url] = {'url': url, 'filename': os.path.basename(url),
+                          'path': entry['path'] if entry else None,
+                          'size': entry['size'] if entry else None,
+                          'digest': entry['digest'] if entry else None}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'photos': list(files.values())}, f, indent=2, ensure_ascii=False)
+    missing = sum(1 for item in files.values() if item['path'] is None and item['url'].startswith('/uploads/photos/'))
+    logging.info(f"Sample photo manifest: {len(files)} photos ({missing} not on disk) in {manifest_path}")
+
+
+def sample_seed_users(total, mix_specs=None, input_path=None, output_path=None, seed=None, shard_bytes=None):
+    """
+    Write exactly `total` seed users drawn from the seed store with the requested marginals, plus
+    a photo manifest for them. Dimensions without a --mix keep the store's own distribution.
+    """
+    if np is None:
+        logging.error("Sample mode requires NumPy. Install it with 'pip install numpy'.")
+        return None
+    input_path = input_path or find_data_file(os.path.join(OUTPUT_DIR, 'seed_users_with_photos.json'))
+    if not input_path or not os.path.exists(input_path):
+        logging.error("No seed store to sample from; run a crawl or pass --input.")
+        return None
+    try:
+        mix = parse_sample_mix(mix_specs)
+    except ValueError as e:
+        logging.error(str(e))
+        return None
+
+    start_time = time.time()
+    rng = np.random.default_rng(seed)
+    strata = read_sample_strata(input_path, mix)
+    shape = tuple(len(categories) for categories in mix.values()) or (1,)
+    admitted = strata >= 0
+    available = np.bincount(strata[admitted], minlength=int(np.prod(shape))).reshape(shape)
+    if int(available.sum()) < total:
+        logging.warning(f"Only {int(available.sum())} users match the mix; sampling all of them instead of {total}")
+    counts = allocate_sample_counts(available, mix, total) if mix else np.array([min(total, int(admitted.sum()))])
+
+    # Random order within each stratum, then take each stratum's first `count` records
+    order = np.lexsort((rng.random(len(strata)), strata))
+    order = order[admitted[order]]
+    starts = np.concatenate(([0], np.cumsum(available.ravel())[:-1]))
+    chosen = np.concatenate([order[start:start + count] for start, count in zip(starts, counts.ravel())])
+    selected = np.zeros(len(strata), dtype=bool)
+    selected[chosen] = True
+    logging.info(f"Sample: chose {int(selected.sum())} of {len(strata)} users in {time.time() - start_time:.1f}s")
+    for axis, (dimension, categories) in enumerate(mix.items()):
+        achieved = counts.sum(axis=tuple(a for a in range(counts.ndim) if a != axis))
+        logging.info(f"Sample {dimension}: " + ", ".join(
+            f"{value} {int(n)} ({n / max(counts.sum(), 1):.1%} vs {share:.1%})"
+            for (value, share), n in zip(categories.items(), achieved)))
+        # Each joint stratum is rounded to whole users, so a category may be off by one per stratum it spans
+        targets = np.array(list(categories.values())) * counts.sum()
+        if np.abs(achieved - targets).max() > max(1, counts.size // len(categories)):
+            logging.warning(f"Sample {dimension} misses its mix: the store does not hold enough users in "
+                            "the combinations the other dimensions require")
+
+    sampled = []
+
+    def sampled_lines():
+        for record in iter_selected_records(input_path, selected):
+            sampled.append({'photos': record.get('photos') or []})
+            yield json.dumps(record, ensure_ascii=False)
+
+    if shard_bytes:
+        output_path = output_path or os.path.join(OUTPUT_DIR, "sample_shards")
+        write_seed_shards(sampled_lines(), output_path, shard_bytes)
+        manifest_path = os.path.join(output_path, "photos.json")
+    else:
+        output_path = output_path or data_path(os.path.join(OUTPUT_DIR, SAMPLE_JSONL_FILENAME))
+        with open_data_file(output_path, 'w') as f:
+            for line in sampled_lines():
+                f.write(line)
+                f.write("\n")
+        manifest_path = re.sub(r"\.jsonl(\.zst|\.gz)?$", "", output_path) + ".photos.json"
+    write_sample_photo_manifest(sampled, manifest_path)
+    logging.info(f"Sample: wrote {len(sampled)} users to {output_path} in {time.time() - start_time:.1f}s")
+    return output_path
+
+
+# --- Parquet Export ---
+# (column, source field, kind). Source fields use the USER_MODEL_SCHEMA dotted notation.
+RAW_PARQUET_COLUMNS = (
+    ("user_id", "user_id", "string"),
+    ("nickname_listing", "nickname_listing", "string"),
+    ("gender_listing", "gender_listing", "string"),
+    ("age_listing", "age_listing", "int32"),
+    ("location_listing", "location_listing", "string"),
+    ("nickname_popup", "nickname_popup", "string"),
+    ("gender_popup_en", "gender_popup_en", "string"),
+    ("marital_status_popup_he", "marital_status_popup_he", "string"),
+    ("age_popup", "age_popup", "int32"),
+    ("about_me_popup", "about_me_popup", "string"),
+    ("general_description_popup", "general_description_popup", "string"),
+    ("iam_into_summary_popup", "iam_into_summary_popup", "string"),
+    ("rating", "rating_popup", "float64"),
+    ("rating_popup", "rating_popup", "string"),
+    ("view_count", "view_count_popup", "int64"),
+    ("favorite_count", "favorite_count_popup", "int64"),
+    ("registration_date", "registration_date_popup", "dmy_date"),
+    ("last_login_popup", "last_login_popup", "string"),
+    ("i_am_tags", "i_am_tags_popup", "list"),
+    ("looking_for_tags", "iam_looking_for_tags_popup", "list"),
+    ("turns_me_on_tags", "turns_me_on_tags_popup", "list"),
+    ("photo_urls", "photo_urls_popup", "list"),
+    ("saved_listing_photo_file", "saved_listing_photo_file", "string"),
+    ("saved_photo_files", "saved_popup_photo_files", "list"),
+    ("seed_username", "seed_username", "string"),
+    ("details_fetched_at", "details_fetched_at", "timestamp"),
+)
+SEED_PARQUET_COLUMNS = (
+    ("username", "username", "string"),
+    ("nickname", "nickname", "string"),
+    ("email", "email", "string"),
+    ("role", "role", "string"),
+    ("account_tier", "accountTier", "string"),
+    ("is_couple", "isCouple", "bool"),
+    ("age", "details.age", "int32"),
+    ("gender", "details.gender", "string"),
+    ("location", "details.location", "string"),
+    ("bio", "details.bio", "string"),
+    ("i_am", "details.iAm", "string"),
+    ("marital_status", "details.maritalStatus", "string"),
+    ("interests", "details.interests", "list"),
+    ("looking_for", "details.lookingFor", "list"),
+    ("into_tags", "details.intoTags", "list"),
+    ("turn_ons", "details.turnOns", "list"),
+    ("photo_urls", "photos[].url", "list"),
+    ("photo_privacy", "photos[].privacy", "list"),
+    ("is_online", "isOnline", "bool"),
+    ("is_verified", "isVerified", "bool"),
+    ("active", "active", "bool"),
+    ("last_active", "lastActive", "timestamp"),
+    ("created_at", "createdAt", "timestamp"),
+    ("updated_at", "updatedAt", "timestamp"),
+)
+PARQUET_LEADING_NUMBER = re.compile(r"^\s*(\d+(?:\.\d+)?)")
+
+
+def parquet_arrow_type(kind):
+    return {
+        "string": pa.string(), "int32": pa.int32(), "int64": pa.int64(), "float64": pa.float64(),
+        "bool": pa.bool_(), "dmy_date": pa.date32(), "timestamp": pa.timestamp("us"),
+        "list": pa.list_(pa.string()),
+    }[kind]
+
+
+def parquet_value(value, kind):
+    """Coerce one JSON value to the Python value Arrow expects for the column kind, or None."""
+    if value is _MISSING or value is None or value == "":
+        return None
+    try:
+        if kind == "string":
+            return str(value)
+        if kind in ("int32", "int64"):
+            return int(value)
+        if kind == "float64":
+            match = PARQUET_LEADING_NUMBER.match(str(value))  # "8.5 (טוב מאוד)" -> 8.5
+            return float(match.group(1)) if match else None
+        if kind == "bool":
+            return bool(value)
+        if kind == "dmy_date":
+            return datetime.strptime(value, "%d/%m/%Y").date()
+        if kind == "timestamp":
+            return datetime.fromisoformat(value)
+        if kind == "list":
+            return [str(item) for item in value if item is not _MISSING and item is not None]
+    except (TypeError, ValueError):
+        return None
+    raise ValueError(f"Unknown Parquet column kind: {kind}")
+
+
+def parquet_schema(columns):
+    return pa.schema([(name, parquet_arrow_type(kind)) for name, _, kind in columns] + [("scrape_date", pa.string())])
+
+
+def iter_parquet_batches(records, columns, scrape_date_of, batch_size=PARQUET_BATCH_SIZE):
+    """Convert a record stream to Arrow record batches, tagging each row with its scrape_date partition."""
+    schema = parquet_schema(columns)
+    getters = []
+    for name, source, kind in columns:
+        get = compile_field_getter(source)
+        # Per-item sources ("photos[].url") already return the list; others return a 1-tuple
+        getters.append((get, kind, "[]." in source))
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) < batch_size:
+            continue
+        yield build_parquet_batch(batch, getters, scrape_date_of, schema)
+        batch = []
+    if batch:
+        yield build_parquet_batch(batch, getters, scrape_date_of, schema)
+
+
+def build_parquet_batch(batch, getters, scrape_date_of, schema):
+    arrays = []
+    for get, kind, per_item in getters:
+        if per_item:
+            arrays.append([parquet_value(get(record), kind) for record in batch])
+        else:
+            arrays.append([parquet_value(get(record)[0], kind) for record in batch])
+    arrays.append([scrape_date_of(record) for record in batch])
+    return pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(arrays, schema)],
+                                      schema=schema)
+
+
+def write_parquet_dataset(batches, schema, target_dir):
+    """Write record batches as a hive-partitioned Parquet dataset, replacing target_dir in one step."""
+    partial_dir = target_dir + ".partial"
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    os.makedirs(partial_dir)
+    pads.write_dataset(batches, partial_dir, schema=schema, format="parquet",
+                       partitioning=pads.partitioning(pa.schema([("scrape_date", pa.string())]), flavor="hive"),
+                       basename_template="part-{i}.parquet", existing_data_behavior="overwrite_or_ignore")
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.replace(partial_dir, target_dir)
+
+
+def export_parquet(output_dir=None):
+    """
+    Export the raw and seed records to Parquet with typed and list columns, partitioned by the
+    date each profile was scraped (details_fetched_at; "unknown" for records older than that field).
+    Seed records take the scrape date of the raw record they were converted from.
+    """
+    if pa is None:
+        logging.error("Export mode requires pyarrow. Install it with 'pip install pyarrow'.")
         return None
 
+    start_time = time.time()
+    output_dir = output_dir or os.path.join(OUTPUT_DIR, PARQUET_DIRNAME)
+    os.makedirs(output_dir, exist_ok=True)
+    scrape_dates_by_username = {}
+    counts = Counter()
+
+    def raw_scrape_date(record):
+        scrape_date = (record.get('details_fetched_at') or '')[:10] or "unknown"
+        if record.get('seed_username'):
+            scrape_dates_by_username[record['seed_username']] = scrape_date
+        counts['raw'] += 1
+        return scrape_date
+
+    def seed_scrape_date(record):
+        counts['seed'] += 1
+        return scrape_dates_by_username.get(record.get('username'), "unknown")
+
+    # Raw first: it fills scrape_dates_by_username for the seed partitions
+    raw_records = iter_history_records(os.path.join(OUTPUT_DIR, JSON_FILENAME))
+    write_parquet_dataset(iter_parquet_batches(raw_records, RAW_PARQUET_COLUMNS, raw_scrape_date),
+                          parquet_schema(RAW_PARQUET_COLUMNS), os.path.join(output_dir, "raw"))
+    seed_records = iter_history_records(os.path.join(OUTPUT_DIR, 'seed_users_with_photos.json'))
+    write_parquet_dataset(iter_parquet_batches(seed_records, SEED_PARQUET_COLUMNS, seed_scrape_date),
+                          parquet_schema(SEED_PARQUET_COLUMNS), os.path.join(output_dir, "seed"))
+    logging.info(f"Exported {counts['raw']} raw and {counts['seed']} seed records to Parquet in {output_dir} "
+                 f"in {time.time() - start_time:.1f}s")
+    return output_dir
+
+
+# --- Profiling ---
+# Sampling profiler that can be switched on for a running crawl: --profile runs it for the whole
+# command, and SIGUSR1 starts it, then writes the reports and stops it on the next SIGUSR1. Work is
+# attributed to the stage that is active on the main thread (see profile_stage), so the collapsed
+# stacks have the stage as their root frame and the memory report has net growth per stage. The
+# sampler records wall-clock stacks: time spent waiting on the network or in polite delays is sampled
+# like any other, which is what shows where a crawl's time goes, but it is not a CPU profile.
+profile_state = {
+    'active': False,
+    'session': 0,  # Bumped on every start, so stages entered before a restart do not count
+    'started_at': None,
+    'stages': [],  # Stage stack of the main thread; the sampler reads its top
+    'samples': Counter(),  # Collapsed stack -> sample count
+    'stage_stats': {},  # Stage -> {'calls', 'seconds', 'net_bytes'}
+    'baseline': None,  # tracemalloc snapshot taken when profiling started
+}
+
+
+@contextlib.contextmanager
+def profile_stage(name):
+    """Attribute the enclosed work to a main() stage while profiling is on; free otherwise."""
+    if not profile_state['active']:
+        yield
+        return
+    session = profile_state['session']
+    profile_state['stages'].append(name)
+    start_time, start_bytes = time.perf_counter(), tracemalloc.get_traced_memory()[0]
+    try:
+        yield
+    finally:
+        if profile_state['active'] and profile_state['session'] == session:
+            stages = profile_state['stages']
+            if stages and stages[-1] == name:
+                stages.pop()
+            stats = profile_state['stage_stats'].setdefault(name, {'calls': 0, 'seconds': 0.0, 'net_bytes': 0})
+            stats['calls'] += 1
+            stats['seconds'] += time.perf_counter() - start_time
+            stats['net_bytes'] += tracemalloc.get_traced_memory()[0] - start_bytes
+
+
+def profile_sampler(session, thread_id):
+    """Sample the main thread's stack until this profiling session ends."""
+    samples = profile_state['samples']
+    while profile_state['active'] and profile_state['session'] == session:
+        frame = sys._current_frames().get(thread_id)
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if frames:
+            stages = profile_state['stages']
+            frames.append(stages[-1] if stages else "other")
+            samples[";".join(reversed(frames))] += 1
+        time.sleep(PROFILE_SAMPLE_INTERVAL)
+
+
+def start_profiling():
+    if profile_state['active']:
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+    profile_state.update(active=True, session=profile_state['session'] + 1, started_at=datetime.now(),
+                         stages=[], samples=Counter(), stage_stats={}, baseline=tracemalloc.take_snapshot())
+    threading.Thread(target=profile_sampler, name="profile-sampler", daemon=True,
+                     args=(profile_state['session'], threading.main_thread().ident)).start()
+    logging.info(f"Profiling started; sampling every {PROFILE_SAMPLE_INTERVAL * 1000:.0f} ms")
+
+
+def stop_profiling():
+    """Stop profiling and write the collapsed wall-clock stacks and the memory report. Returns their paths."""
+    if not profile_state['active']:
+        return None
+    profile_state['active'] = False
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")])
+    tracemalloc.stop()
+
+    profile_dir = os.path.join(OUTPUT_DIR, PROFILE_DIRNAME)
+    os.makedirs(profile_dir, exist_ok=True)
+    stamp = profile_state['started_at'].strftime("%Y%m%d-%H%M%S")
+    wall_path = os.path.join(profile_dir, f"wall-{stamp}.collapsed")
+    memory_path = os.path.join(profile_dir, f"memory-{stamp}.txt")
+    samples = profile_state['samples']
+    with open(wall_path, 'w', encoding='utf-8') as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+
+    stage_samples = Counter()
+    for stack, count in samples.items():
+        stage_samples[stack.split(";", 1)[0]] += count
+    total_samples = max(sum(stage_samples.values()), 1)
+    lines = [f"Profile from {profile_state['started_at'].isoformat()} to {datetime.now().isoformat()}",
+             f"Traced memory now {tracemalloc_total(snapshot) / 1024:.1f} KiB",
+             "Samples are wall-clock: network waits and polite delays count toward their stage", "",
+             f"{'stage':<12}{'calls':>8}{'seconds':>10}{'samples':>10}{'share':>8}{'net KiB':>12}"]
+    stage_stats = profile_state['stage_stats']
+    for stage in sorted(set(stage_stats) | set(stage_samples), key=lambda s: -stage_samples[s]):
+        stats = stage_stats.get(stage, {'calls': 0, 'seconds': 0.0, 'net_bytes': 0})
+        lines.append(f"{stage:<12}{stats['calls']:>8}{stats['seconds']:>10.2f}{stage_samples[stage]:>10}"
+                     f"{stage_samples[stage] / total_samples:>8.1%}{stats['net_bytes'] / 1024:>12.1f}")
+    lines += ["", f"Top {PROFILE_TOP_ALLOCATIONS} allocation sites still live:"]
+    lines += [str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]]
+    lines += ["", f"Top {PROFILE_TOP_ALLOCATIONS} allocation sites by growth since profiling started:"]
+    lines += [str(stat) for stat in snapshot.compare_to(profile_state['baseline'], 'lineno')[:PROFILE_TOP_ALLOCATIONS]]
+    with open(memory_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    profile_state.update(stages=[], baseline=None)
+    logging.info(f"Profiling stopped after {sum(samples.values())} samples; wrote {wall_path} and {memory_path}")
+    return wall_path, memory_path
+
+
+def tracemalloc_total(snapshot):
+    return sum(stat.size for stat in snapshot.statistics('filename'))
+
+
+def toggle_profiling(signum, frame):
+    """SIGUSR1 handler: start profiling, or write the reports and stop if it is already running."""
+    if profile_state['active']:
+        stop_profiling()
+    else:
+        start_profiling()
+
 
 # --- Main Execution ---
 def load_existing_users():
-    """Load existing users from all relevant JSON files to avoid duplicates"""
+    """
+    Collect user IDs from all relevant JSON files to avoid duplicates. Each file is streamed once
+    and only IDs are kept, so startup memory does not grow with the size of the history.
+    """
     existing_user_ids = set()
     
     # Check all possible user data files
@@ -892,21 +3174,20 @@ def load_existing_users():
         os.path.join(OUTPUT_DIR, 'seed_users_with_photos.json'),  # regenerated seed file
     ]
     
-    for filepath in data_files:
-        if os.path.exists(filepath):
+    for base_filepath in data_files:
+        filepath = find_data_file(base_filepath)
+        if filepath:
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    for user in data:
-                        # Handle different JSON structures
-                        user_id = None
-                        if 'user_id' in user:  # Original scraped data
-                            user_id = user['user_id']
-                        elif 'email' in user:  # Seed format
-                            user_id = user['email'].split('@')[0]
-                        
-                        if user_id:
-                            existing_user_ids.add(str(user_id))
+                for user in iter_json_records(filepath):
+                    # Handle different JSON structures
+                    user_id = None
+                    if 'user_id' in user:  # Original scraped data
+                        user_id = user['user_id']
+                    elif 'email' in user:  # Seed format
+                        user_id = user['email'].split('@')[0]
+                    
+                    if user_id:
+                        existing_user_ids.add(str(user_id))
                 logging.info(f"Loaded user IDs from {filepath}: {len(existing_user_ids)} total unique IDs")
             except Exception as e:
                 logging.error(f"Error loading {filepath}: {e}")
@@ -914,51 +3195,240 @@ def load_existing_users():
     return existing_user_ids
 
 
-def main():
+def load_history():
+    """
+    Load the existing raw scraped records and seed records into memory. Only modes that edit
+    stored records in place (retry-failed, refresh) need this; the crawl streams history at save
+    time. Those modes rewrite the history from what is loaded here, so a history file that exists
+    but cannot be read raises instead of coming back empty.
+    """
+    # Load existing scraped data
+    try:
+        all_scraped_user_data = list(iter_history_records(os.path.join(OUTPUT_DIR, JSON_FILENAME)))
+        logging.info(f"Loaded {len(all_scraped_user_data)} existing scraped records")
+    except Exception as e:
+        logging.error(f"Error loading existing scraped data: {e}")
+        raise
+    
+    # Load existing seed data
+    try:
+        seed_format_users = list(iter_history_records(os.path.join(OUTPUT_DIR, 'seed_users_with_photos.json')))
+        logging.info(f"Loaded {len(seed_format_users)} existing seed format records")
+    except Exception as e:
+        logging.error(f"Error loading existing seed data: {e}")
+        raise
+    return all_scraped_user_data, seed_format_users
+
+
+def prepare_photos_dir():
     photos_path = os.path.join(OUTPUT_DIR, PHOTOS_SUBDIR)
     if not os.path.exists(photos_path):
         os.makedirs(photos_path)
         logging.info(f"Created photos subdirectory: {photos_path}")
+    ensure_photo_manifest(photos_path)  # Already warm when called again in serve mode
+    return photos_path
+
 
-    # Load existing users to avoid duplicates
-    existing_user_ids = load_existing_users()
-    logging.info(f"Found {len(existing_user_ids)} existing users to skip")
+def scrape_user(user_summary, photos_path):
+    """
+    Fetch details and photos for one listing entry. Returns the full raw record, or None if the
+    details fetch failed, in which case the user is dead-lettered and left unprocessed.
+    """
+    user_id = user_summary.get('user_id')
+    full_user_data = dict(user_summary)
+
+    # Determine gender for photo naming
+    gender_for_photo = user_summary.get('gender_listing')
     
-    # Load existing data to append to
-    all_scraped_user_data = []
-    seed_format_users = []
+    # Add debug logging to see what gender we got from listing
+    logging.debug(f"User {user_id} - Gender from listing: {gender_for_photo}")
     
-    # Load existing scraped data
+    listing_photo_url = user_summary.get('photo_url_listing')
+    if listing_photo_url:
+        with profile_stage("photos"):
+            saved_listing_photo = download_photo(listing_photo_url, user_id, photos_path, "listing_main",
+                                                 gender=gender_for_photo)
+        full_user_data['saved_listing_photo_file'] = saved_listing_photo
+
+    user_popup_details = fetch_user_details(user_id, user_summary)
+    if user_popup_details is None:
+        return None
+    full_user_data.update(user_popup_details)
+    full_user_data['saved_popup_photo_files'] = download_popup_photos(full_user_data, photos_path)
+    return full_user_data
+
+
+def fetch_user_details(user_id, user_summary):
+    """Fetch popup details, dead-lettering the user on failure. Returns the details or None."""
+    with profile_stage("popup"):
+        user_popup_details = fetch_and_parse_user_details(user_id)
+    if user_popup_details.get('error'):
+        record_failure("details", user_id, user_popup_details['error'], payload=dict(user_summary))
+        return None
+    clear_failure("details", user_id)
+    user_popup_details['details_fetched_at'] = datetime.now().isoformat()
+    return user_popup_details
+
+
+def download_popup_photos(full_user_data, photos_path, known_urls=()):
+    """
+    Download the popup photos of a record and return the saved files. Photos already in the
+    manifest cost no request; URLs in known_urls were fetched before, so they skip the polite sleep.
+    """
+    user_id = full_user_data.get('user_id')
+    listing_photo_url = full_user_data.get('photo_url_listing')
+
+    # Gender for photo naming, preferring popup details over the listing
+    gender_for_photo = full_user_data.get('gender_listing')
+    if full_user_data.get('gender_popup_en'):
+        gender_for_photo = full_user_data['gender_popup_en']
+    elif full_user_data.get('gender_popup_he'):
+        gender_he = full_user_data['gender_popup_he']
+        gender_for_photo = hebrew_to_english_gender(gender_he)
+
+    popup_photo_urls = full_user_data.get('photo_urls_popup', [])
+    saved_popup_photos_files = []
+    if popup_photo_urls:
+        logging.info(f"Found {len(popup_photo_urls)} photo URLs in popup for user {user_id}.")
+        for i, p_url in enumerate(popup_photo_urls):
+            if p_url == listing_photo_url and 'saved_listing_photo_file' in full_user_data and full_user_data[
+                'saved_listing_photo_file']:
+                logging.debug(
+                    f"Popup photo {i + 1} for user {user_id} is same as listing photo. Using existing path: {full_user_data['saved_listing_photo_file']}")
+                if full_user_data['saved_listing_photo_file'] not in saved_popup_photos_files:
+                    saved_popup_photos_files.append(full_user_data['saved_listing_photo_file'])
+                continue
+
+            # Check if already downloaded if multiple popup URLs point to same effective image
+            # (e.g. customerId=X&number=1 might be in list twice due to different relative paths resolving same)
+            # This check is a bit simplistic, relies on exact URL match after resolution.
+            # A more robust check would involve hashing filenames based on URL parameters.
+            # However, the download_photo function itself checks if file exists.
+
+            with profile_stage("photos"):
+                saved_file = download_photo(p_url, user_id, photos_path, f"popup_{i + 1}", gender=gender_for_photo)
+            if saved_file and saved_file not in saved_popup_photos_files:
+                saved_popup_photos_files.append(saved_file)
+            if p_url not in known_urls:
+                polite_sleep(0.3, 0.8)
+    return saved_popup_photos_files
+
+
+def convert_scraped_user(full_user_data, existing_seed=None):
+    """Convert a raw record to User model format, remembering its seed username on the raw record."""
+    with profile_stage("convert"):
+        user_model_data = convert_to_user_model(full_user_data, existing_seed)
+    if user_model_data:
+        full_user_data['seed_username'] = user_model_data['username']
+        clear_failure("convert", full_user_data.get('user_id'))
+        logging.info(f"Successfully converted user {full_user_data.get('user_id')} to User model format")
+    return user_model_data
+
+
+def build_seed_index(seed_format_users):
+    """Position of each seed record by username and by email, for upsert_seed_record and find_seed_record."""
+    seed_index = {}
+    for i, record in enumerate(seed_format_users):
+        for key in (record.get('username'), record.get('email')):
+            if key:
+                seed_index[key] = i
+    return seed_index
+
+
+def find_seed_record(seed_format_users, seed_index, raw_record):
+    """
+    The seed record a raw record was exported as, or None. Records scraped before raw records
+    carried seed_username are found through their seed email, whose local part was the user_id.
+    """
+    position = seed_index.get(raw_record.get('seed_username'))
+    if position is None:
+        position = seed_index.get(f"{raw_record.get('user_id')}@example.com")
+    return seed_format_users[position] if position is not None else None
+
+
+def upsert_seed_record(seed_format_users, seed_index, user_model_data):
+    """Replace the seed record with the same username, or append it if there is none."""
+    position = seed_index.get(user_model_data['username'])
+    if position is None:
+        position = len(seed_format_users)
+        seed_format_users.append(user_model_data)
+    else:
+        seed_format_users[position] = user_model_data
+    seed_index[user_model_data['username']] = seed_index[user_model_data['email']] = position
+
+
+def save_outputs(scraped_records, seed_records, append=True):
+    """
+    Write the raw data, validated seed file and shards, photo manifest and dead-letter store.
+    With append=True the given records are new ones and the stored history is streamed in ahead
+    of them; with append=False they are the complete data set. Returns (raw_total, seed_total).
+    """
     json_filepath = os.path.join(OUTPUT_DIR, JSON_FILENAME)
-    if os.path.exists(json_filepath):
-        try:
-            with open(json_filepath, 'r', encoding='utf-8') as f:
-                all_scraped_user_data = json.load(f)
-            logging.info(f"Loaded {len(all_scraped_user_data)} existing scraped records")
-        except Exception as e:
-            logging.error(f"Error loading existing scraped data: {e}")
-    
-    # Load existing seed data
     seed_json_filepath = os.path.join(OUTPUT_DIR, 'seed_users_with_photos.json')
-    if os.path.exists(seed_json_filepath):
-        try:
-            with open(seed_json_filepath, 'r', encoding='utf-8') as f:
-                seed_format_users = json.load(f)
-            logging.info(f"Loaded {len(seed_format_users)} existing seed format records")
-        except Exception as e:
-            logging.error(f"Error loading existing seed data: {e}")
-    
-    processed_user_ids = existing_user_ids.copy()
+    raw_total, seed_total = 0, 0
+    # Reserve the new usernames before any record carrying them is written
+    flush_username_registry()
     
-    # Track new vs skipped users
-    new_users_count = 0
-    skipped_users_count = 0
+    with profile_stage("serialize"):
+        try:
+            # Save original scraped data
+            existing_raw = iter_history_records(json_filepath) if append else iter(())
+            json_filepath, raw_total = save_json_records(chain(existing_raw, scraped_records), json_filepath)
+            logging.info(
+                f"Successfully saved complete data with {raw_total} total users to '{json_filepath}'.")
+        
+            # Only records that pass User model validation reach the seed file and shards
+            seed_records, seed_rejects, seed_error_counts = validate_seed_records(seed_records)
+            log_validation_summary(len(seed_records), len(seed_rejects), seed_error_counts)
+            remove_data_variants(os.path.join(OUTPUT_DIR, SEED_REJECTS_FILENAME))
+            if seed_rejects:
+                logging.warning(f"Rejected seed records written to {write_seed_rejects(seed_rejects)}")
+
+            # Save User model formatted data
+            existing_seed = iter_history_records(seed_json_filepath) if append else iter(())
+            seed_json_filepath, seed_total = save_json_records(chain(existing_seed, seed_records), seed_json_filepath)
+            logging.info(
+                f"Successfully saved {seed_total} users in User model format to '{seed_json_filepath}'.")
+            write_seed_shards((json.dumps(u, ensure_ascii=False) for u in iter_json_records(seed_json_filepath)),
+                              os.path.join(OUTPUT_DIR, SEED_SHARD_DIRNAME))
+            if append:
+                index_profiles(scraped_records)
+            else:
+                rebuild_profile_index(scraped_records)
+            index_seed_usernames(seed_records)
+            save_profile_index()
+            save_photo_manifest()
+        
+            # Clean up temp files
+            remove_data_variants(os.path.join(OUTPUT_DIR, f"{JSON_FILENAME}.tmp"))
+        except Exception as e_json:
+            logging.error(f"An error occurred during final JSON saving: {e_json}")
+    save_dead_letters()
+    return raw_total, seed_total
+
 
+def save_progress(new_scraped_user_data):
+    """Incremental save of this run's raw records, usernames, photo manifest and dead letters during a long run."""
+    temp_json_filepath = os.path.join(OUTPUT_DIR, f"{JSON_FILENAME}.tmp")
+    try:
+        flush_username_registry()
+        with profile_stage("serialize"):
+            temp_json_filepath = save_json_data(new_scraped_user_data, temp_json_filepath)
+        logging.info(f"Incrementally saved {len(new_scraped_user_data)} new users to {temp_json_filepath}")
+        save_photo_manifest()
+        save_dead_letters()
+    except Exception as e_json_tmp:
+        logging.error(f"Error during incremental JSON save: {e_json_tmp}")
+
+
+def detect_total_pages():
+    """Read the pager on the first listing page. Returns 0 if unknown, or None if the page failed."""
     logging.info("Attempting to determine total number of pages for listing...")
-    first_page_html = get_listing_page_html(LISTING_URL_TEMPLATE.format(page_num=1))
+    with profile_stage("listing"):
+        first_page_html = get_listing_page_html(LISTING_URL_TEMPLATE.format(page_num=1))
+        detected_max_page = parse_users_from_listing(first_page_html)[1] if first_page_html else 0
     total_pages = 0
     if first_page_html:
-        _, detected_max_page = parse_users_from_listing(first_page_html)
         if detected_max_page > 0:
             total_pages = detected_max_page
             logging.info(f"Successfully determined total pages from pager: {total_pages}")
@@ -967,8 +3437,15 @@ def main():
                 "Could not determine total pages from pager. Will attempt to scrape sequentially until 3 empty pages.")
     else:
         logging.error("Failed to fetch the first page. Cannot determine total pages or proceed. Exiting.")
-        return
+        return None
+    return total_pages
 
+
+def iter_listing_pages(total_pages):
+    """
+    Walk the listing pages and yield the parsed user summaries of each one. Failed pages are
+    dead-lettered, and the polite sleep between pages happens after the caller is done with a page.
+    """
     start_page = 1
     # Override for testing:
     # total_pages = 1
@@ -991,24 +3468,75 @@ def main():
         logging.info(
             f"--- Processing Listing Page {current_page_num} / {total_pages if total_pages > 0 else 'Dynamic'} ---")
         page_url = LISTING_URL_TEMPLATE.format(page_num=current_page_num)
-        listing_html = get_listing_page_html(page_url)
+        with profile_stage("listing"):
+            listing_html = get_listing_page_html(page_url)
+            users_on_page = parse_users_from_listing(listing_html)[0] if listing_html else []
 
         if not listing_html:
             logging.warning(f"No content fetched for listing page {current_page_num}. Skipping.")
+            record_failure("listing", reason=f"Failed to fetch {page_url}", key=str(current_page_num))
             if total_pages == 0: consecutive_empty_listing_pages += 1
-            time.sleep(random.uniform(3.0, 5.0))
+            polite_sleep(3.0, 5.0)
             continue
+        clear_failure("listing", key=str(current_page_num))
 
-        users_on_page, _ = parse_users_from_listing(listing_html)
         if not users_on_page:
             logging.info(f"No users found/parsed on listing page {current_page_num}.")
             if total_pages == 0: consecutive_empty_listing_pages += 1
-            time.sleep(random.uniform(1.0, 2.0))
+            polite_sleep(1.0, 2.0)
             continue
 
         if total_pages == 0: consecutive_empty_listing_pages = 0
 
+        yield users_on_page
+
+        logging.info(f"Finished processing page {current_page_num}. Sleeping before next page...")
+        # Make sleep time dependent on if total_pages known, to be faster in fixed-page mode.
+        polite_sleep(*((1.5, 3.0) if total_pages > 0 else (2.5, 5.5)))
+        if total_pages > 0 and current_page_num == total_pages:  # If it's the last known page
+            logging.info(f"Reached the last detected page: {total_pages}. Stopping main page loop.")
+            break
+
+
+stop_requested = threading.Event()  # Set on SIGTERM in serve mode; the crawl stops and saves what it has
+
+
+def main(known_user_ids=None):
+    """
+    Crawl the listing and scrape users not seen before. known_user_ids is the warm ID set kept by
+    serve mode and is updated in place, along with the dead letters; without it both are loaded
+    from disk. Returns a summary of the run, or None if the listing could not be fetched. Runs that
+    find no new users write nothing but the photo manifest and dead letters, and report
+    raw_total/seed_total as None.
+    """
+    photos_path = prepare_photos_dir()
+    if known_user_ids is None:
+        load_dead_letters()
+
+    # Load existing user IDs to avoid duplicates; the history itself is only streamed at save time
+    if known_user_ids is None:
+        known_user_ids = load_existing_users()
+    logging.info(f"Found {len(known_user_ids)} existing users to skip")
+    
+    # Records scraped in this run, appended to the stored history by save_outputs
+    all_scraped_user_data = []
+    seed_format_users = []
+    
+    processed_user_ids = known_user_ids
+    
+    # Track new vs skipped users
+    new_users_count = 0
+    skipped_users_count = 0
+    failed_users_count = 0
+
+    total_pages = detect_total_pages()
+    if total_pages is None:
+        return None
+
+    for users_on_page in iter_listing_pages(total_pages):
         for user_summary in users_on_page:
+            if stop_requested.is_set():
+                break
             user_id = user_summary.get('user_id')
             if not user_id: logging.warning(f"Skipping user summary due to missing user_id: {user_summary}"); continue
             
@@ -1020,114 +3548,479 @@ def main():
 
             logging.info(
                 f"Processing NEW User ID: {user_id}, Listing Nickname: {user_summary.get('nickname_listing', 'N/A')}")
+            full_user_data = scrape_user(user_summary, photos_path)
+            if full_user_data is None:
+                # Dead-lettered; left out of processed_user_ids so a later run or retry-failed picks it up
+                failed_users_count += 1
+                polite_sleep(1.5, 3.0)
+                continue
             new_users_count += 1
-            full_user_data = dict(user_summary)
-
-            # Determine gender for photo naming
-            gender_for_photo = user_summary.get('gender_listing')
-            
-            # Add debug logging to see what gender we got from listing
-            logging.debug(f"User {user_id} - Gender from listing: {gender_for_photo}")
-            
-            listing_photo_url = user_summary.get('photo_url_listing')
-            if listing_photo_url:
-                saved_listing_photo = download_photo(listing_photo_url, user_id, photos_path, "listing_main", gender=gender_for_photo)
-                full_user_data['saved_listing_photo_file'] = saved_listing_photo
-
-            user_popup_details = fetch_and_parse_user_details(user_id)
-            full_user_data.update(user_popup_details)
-            
-            # Update gender from popup details if available
-            if user_popup_details.get('gender_popup_en'):
-                gender_for_photo = user_popup_details['gender_popup_en']
-            elif user_popup_details.get('gender_popup_he'):
-                gender_he = user_popup_details['gender_popup_he']
-                gender_for_photo = hebrew_to_english_gender(gender_he)
-
-            popup_photo_urls = user_popup_details.get('photo_urls_popup', [])
-            saved_popup_photos_files = []
-            if popup_photo_urls:
-                logging.info(f"Found {len(popup_photo_urls)} photo URLs in popup for user {user_id}.")
-                for i, p_url in enumerate(popup_photo_urls):
-                    if p_url == listing_photo_url and 'saved_listing_photo_file' in full_user_data and full_user_data[
-                        'saved_listing_photo_file']:
-                        logging.debug(
-                            f"Popup photo {i + 1} for user {user_id} is same as listing photo. Using existing path: {full_user_data['saved_listing_photo_file']}")
-                        if full_user_data['saved_listing_photo_file'] not in saved_popup_photos_files:
-                            saved_popup_photos_files.append(full_user_data['saved_listing_photo_file'])
-                        continue
-
-                    # Check if already downloaded if multiple popup URLs point to same effective image
-                    # (e.g. customerId=X&number=1 might be in list twice due to different relative paths resolving same)
-                    # This check is a bit simplistic, relies on exact URL match after resolution.
-                    # A more robust check would involve hashing filenames based on URL parameters.
-                    # However, the download_photo function itself checks if file exists.
-
-                    saved_file = download_photo(p_url, user_id, photos_path, f"popup_{i + 1}", gender=gender_for_photo)
-                    if saved_file and saved_file not in saved_popup_photos_files:
-                        saved_popup_photos_files.append(saved_file)
-                    time.sleep(random.uniform(0.3, 0.8))
-            full_user_data['saved_popup_photo_files'] = saved_popup_photos_files
 
             all_scraped_user_data.append(full_user_data)
             processed_user_ids.add(str(user_id))
             
             # Convert to User model format
-            user_model_data = convert_to_user_model(full_user_data)
+            user_model_data = convert_scraped_user(full_user_data)
             if user_model_data:
                 seed_format_users.append(user_model_data)
-                logging.info(f"Successfully converted user {user_id} to User model format")
 
             if len(all_scraped_user_data) % 25 == 0:  # Incremental save every 25 users
-                temp_json_filepath = os.path.join(OUTPUT_DIR, f"{JSON_FILENAME}.tmp")
-                try:
-                    with open(temp_json_filepath, 'w', encoding='utf-8') as f_tmp:
-                        json.dump(all_scraped_user_data, f_tmp, indent=4, ensure_ascii=False)
-                    logging.info(f"Incrementally saved {len(all_scraped_user_data)} users to {temp_json_filepath}")
-                except Exception as e_json_tmp:
-                    logging.error(f"Error during incremental JSON save: {e_json_tmp}")
-
-            time.sleep(random.uniform(1.5, 3.0))  # Polite sleep between fetching each user's details
+                save_progress(all_scraped_user_data)
 
-        logging.info(f"Finished processing page {current_page_num}. Sleeping before next page...")
-        # Make sleep time dependent on if total_pages known, to be faster in fixed-page mode.
-        sleep_between_pages = random.uniform(1.5, 3.0) if total_pages > 0 else random.uniform(2.5, 5.5)
-        time.sleep(sleep_between_pages)
-        if total_pages > 0 and current_page_num == total_pages:  # If it's the last known page
-            logging.info(f"Reached the last detected page: {total_pages}. Stopping main page loop.")
+            polite_sleep(1.5, 3.0)  # Polite sleep between fetching each user's details
+        if stop_requested.is_set():
+            logging.warning("Stop requested; saving the users scraped so far.")
             break
 
-    json_filepath = os.path.join(OUTPUT_DIR, JSON_FILENAME)
-    seed_json_filepath = os.path.join(OUTPUT_DIR, 'seed_users_with_photos.json')
-    
-    try:
-        # Save original scraped data
-        with open(json_filepath, 'w', encoding='utf-8') as f:
-            json.dump(all_scraped_user_data, f, indent=4, ensure_ascii=False)
-        logging.info(
-            f"Successfully saved complete data with {len(all_scraped_user_data)} total users to '{json_filepath}'.")
-        
-        # Save User model formatted data
-        with open(seed_json_filepath, 'w', encoding='utf-8') as f:
-            json.dump(seed_format_users, f, indent=4, ensure_ascii=False)
-        logging.info(
-            f"Successfully saved {len(seed_format_users)} users in User model format to '{seed_json_filepath}'.")
-        
-        # Clean up temp files
-        temp_json_filepath = os.path.join(OUTPUT_DIR, f"{JSON_FILENAME}.tmp")
-        if os.path.exists(temp_json_filepath):
-            try:
-                os.remove(temp_json_filepath)
-            except OSError:
-                logging.warning(f"Could not remove temp file: {temp_json_filepath}")
-    except Exception as e_json:
-        logging.error(f"An error occurred during final JSON saving: {e_json}")
+    if all_scraped_user_data:
+        raw_total, seed_total = save_outputs(all_scraped_user_data, seed_format_users)
+    else:
+        # Nothing to append: leave the history, shards and index alone (serve mode runs this often)
+        raw_total, seed_total = None, None
+        save_photo_manifest()
+        save_dead_letters()
 
     logging.info(f"Scraping process completed.")
     logging.info(f"Added {new_users_count} new users, skipped {skipped_users_count} existing users.")
-    logging.info(f"Total unique users now: {len(all_scraped_user_data)}")
-    logging.info(f"Total users in seed format: {len(seed_format_users)}")
+    if failed_users_count:
+        logging.info(f"{failed_users_count} users failed and were dead-lettered; run 'retry-failed' to reprocess them.")
+    if raw_total is None:
+        logging.info("No new users; data files left untouched.")
+    else:
+        logging.info(f"Total unique users now: {raw_total}")
+        logging.info(f"Total users in seed format: {seed_total}")
+    return {'new': new_users_count, 'skipped': skipped_users_count, 'failed': failed_users_count,
+            'raw_total': raw_total, 'seed_total': seed_total}
+
+
+# --- Serve Mode ---
+# Keeps the seen-ID set, photo manifest, username registry, profile index and HTTP session warm
+# between scheduled crawls, so each run starts with the first listing request instead of a cold load.
+serve_status = {
+    'state': 'starting', 'started_at': None, 'runs': 0, 'users_added_total': 0, 'users_failed_total': 0,
+    'last_run': None, 'next_run_at': None, 'known_users': 0,
+}
+serve_lock = threading.Lock()
+serve_trigger = threading.Event()
+
+
+def serve_metrics():
+    """Prometheus text exposition of the serve counters and gauges."""
+    with serve_lock:
+        status = dict(serve_status)
+    last_run = status['last_run'] or {}
+    lines = [
+        f"zbeng_scraper_runs_total {status['runs']}",
+        f"zbeng_scraper_users_added_total {status['users_added_total']}",
+        f"zbeng_scraper_users_failed_total {status['users_failed_total']}",
+        f"zbeng_scraper_running {1 if status['state'] == 'running' else 0}",
+        f"zbeng_scraper_known_users {status['known_users']}",
+        f"zbeng_scraper_dead_letters {len(dead_letters)}",
+        f"zbeng_scraper_photos {len(photo_manifest)}",
+        f"zbeng_scraper_last_run_duration_seconds {last_run.get('duration_seconds', 0)}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+class ServeHandler(BaseHTTPRequestHandler):
+    """GET /status (JSON), GET /metrics (Prometheus text), POST /run (start a crawl now)."""
+
+    def log_message(self, format, *args):
+        logging.debug("serve: %s - %s", self.address_string(), format % args)
+
+    def send_body(self, status, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/status":
+            with serve_lock:
+                status = dict(serve_status, dead_letters=len(dead_letters), photos=len(photo_manifest))
+            self.send_body(200, json.dumps(status, indent=2, ensure_ascii=False), "application/json")
+        elif self.path == "/metrics":
+            self.send_body(200, serve_metrics(), "text/plain; version=0.0.4")
+        else:
+            self.send_body(404, "Not Found\n", "text/plain")
+
+    def do_POST(self):
+        if self.path != "/run":
+            self.send_body(404, "Not Found\n", "text/plain")
+            return
+        with serve_lock:
+            running = serve_status['state'] == 'running'
+        if running:
+            self.send_body(409, json.dumps({'error': 'a run is already in progress'}), "application/json")
+            return
+        serve_trigger.set()
+        self.send_body(202, json.dumps({'queued': True}), "application/json")
+
+
+def request_stop(signum, frame):
+    """SIGTERM/SIGINT handler: finish the current user, save, then leave the serve loop."""
+    logging.info(f"Received signal {signum}; stopping after the current user and flushing state.")
+    stop_requested.set()
+    serve_trigger.set()
+
+
+def serve(interval_minutes=SERVE_INTERVAL_MINUTES, port=SERVE_PORT):
+    """Run incremental crawls every interval_minutes (and on POST /run) with state kept in memory."""
+    start_time = time.time()
+    prepare_photos_dir()
+    load_dead_letters()
+    load_username_registry()
+    ensure_profile_index()
+    known_user_ids = load_existing_users()
+    with serve_lock:
+        serve_status.update(state='idle', started_at=datetime.now().isoformat(), known_users=len(known_user_ids))
+    logging.info(f"Serve: warm state loaded in {time.time() - start_time:.1f}s ({len(known_user_ids)} known users)")
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), ServeHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="serve-status", daemon=True).start()
+    logging.info(f"Serve: status on http://127.0.0.1:{httpd.server_address[1]}/status, "
+                 f"trigger with POST /run, crawling every {interval_minutes} minutes")
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    try:
+        while not stop_requested.is_set():
+            run_started = time.time()
+            with serve_lock:
+                serve_status.update(state='running', next_run_at=None)
+            try:
+                summary = main(known_user_ids)
+            except Exception as e:
+                logging.exception(f"Serve: run failed: {e}")
+                summary = {'error': str(e)}
+            summary = summary or {'error': 'listing could not be fetched'}
+            summary.update(started_at=datetime.fromtimestamp(run_started).isoformat(),
+                           duration_seconds=round(time.time() - run_started, 3))
+            next_run = datetime.now() + timedelta(minutes=interval_minutes)
+            with serve_lock:
+                serve_status['runs'] += 1
+                serve_status['users_added_total'] += summary.get('new', 0)
+                serve_status['users_failed_total'] += summary.get('failed', 0)
+                serve_status.update(state='idle', last_run=summary, known_users=len(known_user_ids),
+                                    next_run_at=next_run.isoformat())
+            if stop_requested.is_set():
+                break
+            serve_trigger.wait(timeout=interval_minutes * 60)
+            serve_trigger.clear()
+    finally:
+        with serve_lock:
+            serve_status['state'] = 'stopping'
+        # Runs already save everything they touch; this covers anything recorded since the last save
+        flush_username_registry()
+        save_profile_index()
+        save_photo_manifest()
+        save_dead_letters()
+        httpd.shutdown()
+        logging.info("Serve: state flushed, exiting.")
+
+
+def comparable_detail(field, value):
+    """
+    Detail value as refresh compares it. aboutMe whitespace is collapsed, because records stored
+    before the line-preserving sanitizer hold the same text on one line.
+    """
+    if field == 'about_me_popup':
+        return " ".join((value or "").split())
+    return value
+
+
+def refresh_user(stored_user, user_summary, photos_path, recheck_before=None):
+    """
+    Bring one known raw record up to date in place. Details are re-fetched only when the listing
+    fields differ from the stored ones, or when recheck_before (ISO time) is newer than the last
+    details fetch. Only photos that were not flagged before are downloaded. A failed details fetch
+    is dead-lettered and leaves the stored details, including details_fetched_at, as they were.
+    Returns (fetched, changed, failed): whether details were fetched, whether the profile changed
+    and whether the details fetch failed.
+    """
+    user_id = str(stored_user.get('user_id'))
+    changed_fields = [f for f in REFRESH_LISTING_FIELDS if user_summary.get(f) != stored_user.get(f)]
+    stale = recheck_before is not None and (stored_user.get('details_fetched_at') or '') < recheck_before
+    if not changed_fields and not stale:
+        return False, False, False
+
+    logging.info(f"Refreshing user {user_id}: "
+                 f"{'listing changed (' + ', '.join(changed_fields) + ')' if changed_fields else 'details are stale'}")
+    stored_user.update(user_summary)
+    if 'photo_url_listing' in changed_fields and user_summary.get('photo_url_listing'):
+        stored_user['saved_listing_photo_file'] = download_photo(
+            user_summary['photo_url_listing'], user_id, photos_path, "listing_main",
+            gender=user_summary.get('gender_listing'))
+
+    user_popup_details = fetch_user_details(user_id, user_summary)
+    if user_popup_details is None:
+        return False, bool(changed_fields), True
+
+    # lastLogIn and the img2..img4 flags (photo_urls_popup) are the fields that move most often
+    known_photo_urls = list(stored_user.get('photo_urls_popup') or [])
+    details_changed = [k for k in REFRESH_DETAIL_FIELDS
+                       if comparable_detail(k, stored_user.get(k)) != comparable_detail(k, user_popup_details.get(k))]
+    stored_user.update(user_popup_details)
+    if 'photo_urls_popup' in details_changed or 'photo_url_listing' in changed_fields:
+        new_photos = [u for u in user_popup_details.get('photo_urls_popup', []) if u not in known_photo_urls]
+        logging.info(f"User {user_id} has {len(new_photos)} newly flagged photo(s)")
+        stored_user['saved_popup_photo_files'] = download_popup_photos(stored_user, photos_path, known_photo_urls)
+    if details_changed:
+        logging.debug(f"User {user_id} details changed: {', '.join(details_changed)}")
+    return True, bool(changed_fields or details_changed), False
+
+
+def refresh_profiles(recheck_days=None):
+    """
+    Walk the listing and update known profiles that changed, adding any new ones as the crawl
+    would. Outputs are rewritten only if something changed.
+    """
+    photos_path = prepare_photos_dir()
+    load_dead_letters()
+    try:
+        all_scraped_user_data, seed_format_users = load_history()
+    except Exception:
+        logging.error("Refresh aborted: the stored history could not be read, and saving would overwrite it.")
+        return None
+    users_by_id = {str(u.get('user_id')): u for u in all_scraped_user_data if u.get('user_id')}
+    seed_index = build_seed_index(seed_format_users)
+    recheck_before = None
+    if recheck_days is not None:
+        recheck_before = (datetime.now() - timedelta(days=recheck_days)).isoformat()
+
+    total_pages = detect_total_pages()
+    if total_pages is None:
+        return
+
+    unchanged_count, fetched_count, changed_count, new_users_count, failed_users_count = 0, 0, 0, 0, 0
+    outputs_dirty = False
+    for users_on_page in iter_listing_pages(total_pages):
+        for user_summary in users_on_page:
+            user_id = str(user_summary.get('user_id') or '')
+            if not user_id:
+                continue
+            stored_user = users_by_id.get(user_id)
+            if stored_user is None:
+                full_user_data = scrape_user(user_summary, photos_path)
+                if full_user_data is None:
+                    failed_users_count += 1
+                else:
+                    new_users_count += 1
+                    all_scraped_user_data.append(full_user_data)
+                    users_by_id[user_id] = full_user_data
+                    outputs_dirty = True
+                    user_model_data = convert_scraped_user(full_user_data)
+                    if user_model_data:
+                        upsert_seed_record(seed_format_users, seed_index, user_model_data)
+                polite_sleep(1.5, 3.0)
+                continue
+
+            fetched, changed, failed = refresh_user(stored_user, user_summary, photos_path, recheck_before)
+            failed_users_count += failed
+            if not fetched and not changed:
+                unchanged_count += not failed
+                if failed:
+                    polite_sleep(1.5, 3.0)
+                continue
+            fetched_count += fetched
+            # A details fetch alone still updates details_fetched_at, which --recheck-days relies on
+            outputs_dirty = True
+            if changed:
+                changed_count += 1
+                user_model_data = convert_scraped_user(
+                    stored_user, find_seed_record(seed_format_users, seed_index, stored_user))
+                if user_model_data:
+                    upsert_seed_record(seed_format_users, seed_index, user_model_data)
+            if fetched or failed:
+                polite_sleep(1.5, 3.0)
+
+    if outputs_dirty:
+        save_outputs(all_scraped_user_data, seed_format_users, append=False)
+    else:
+        logging.info("No profile changes found; data files left untouched.")
+        save_photo_manifest()
+        save_dead_letters()
+    logging.info(f"Refresh finished: {unchanged_count} unchanged, {fetched_count} re-fetched, "
+                 f"{changed_count} changed, {new_users_count} new, {failed_users_count} failed.")
+
+
+def retry_failed():
+    """Reprocess only the dead-lettered listing pages, detail fetches, photos and conversions."""
+    photos_path = prepare_photos_dir()
+    load_dead_letters()
+    try:
+        all_scraped_user_data, seed_format_users = load_history()
+    except Exception:
+        logging.error("Retry aborted: the stored history could not be read, and saving would overwrite it.")
+        return None
+    users_by_id = {str(u.get('user_id')): u for u in all_scraped_user_data if u.get('user_id')}
+    seed_index = build_seed_index(seed_format_users)
+
+    entries = [e for e in dead_letters.values() if e['attempts'] < MAX_DEAD_LETTER_ATTEMPTS]
+    given_up = len(dead_letters) - len(entries)
+    if given_up:
+        logging.warning(f"Skipping {given_up} dead-letter entries that failed {MAX_DEAD_LETTER_ATTEMPTS}+ times")
+    entries.sort(key=lambda e: DEAD_LETTER_STAGES.index(e['stage']))
+    logging.info(f"Retrying {len(entries)} dead-letter entries")
+
+    def add_new_user(user_summary):
+        full_user_data = scrape_user(user_summary, photos_path)
+        if full_user_data is None:
+            return
+        all_scraped_user_data.append(full_user_data)
+        users_by_id[str(full_user_data['user_id'])] = full_user_data
+        user_model_data = convert_scraped_user(full_user_data)
+        if user_model_data:
+            upsert_seed_record(seed_format_users, seed_index, user_model_data)
+        polite_sleep(1.5, 3.0)
+
+    for entry in entries:
+        stage, user_id = entry['stage'], entry.get('user_id')
+        payload = entry.get('payload') or {}
+        if stage == "listing":
+            page_url = LISTING_URL_TEMPLATE.format(page_num=entry['key'])
+            listing_html = get_listing_page_html(page_url)
+            if not listing_html:
+                record_failure("listing", reason=f"Failed to fetch {page_url}", key=entry['key'])
+                continue
+            clear_failure("listing", key=entry['key'])
+            users_on_page, _ = parse_users_from_listing(listing_html)
+            for user_summary in users_on_page:
+                if user_summary.get('user_id') and str(user_summary['user_id']) not in users_by_id:
+                    add_new_user(user_summary)
+        elif stage == "details":
+            stored_user = users_by_id.get(user_id)
+            if stored_user is None:
+                add_new_user(payload)
+                continue
+            # A known user whose refresh re-fetch failed: fetch again through the refresh path, which
+            # clears the entry only if the fetch succeeds
+            _, changed, _ = refresh_user(stored_user, payload, photos_path,
+                                         recheck_before=datetime.now().isoformat())
+            if changed:
+                user_model_data = convert_scraped_user(
+                    stored_user, find_seed_record(seed_format_users, seed_index, stored_user))
+                if user_model_data:
+                    upsert_seed_record(seed_format_users, seed_index, user_model_data)
+            polite_sleep(1.5, 3.0)
+        elif stage == "photo":
+            saved_file = download_photo(payload['photo_url'], user_id, payload['photos_dir'],
+                                        payload['photo_label'], gender=payload.get('gender'))
+            user_data = users_by_id.get(user_id)
+            if not saved_file or user_data is None:
+                continue
+            if payload['photo_label'] == "listing_main":
+                user_data['saved_listing_photo_file'] = saved_file
+            elif saved_file not in (user_data.get('saved_popup_photo_files') or []):
+                user_data.setdefault('saved_popup_photo_files', []).append(saved_file)
+            user_model_data = convert_scraped_user(
+                user_data, find_seed_record(seed_format_users, seed_index, user_data))
+            if user_model_data:
+                upsert_seed_record(seed_format_users, seed_index, user_model_data)
+            polite_sleep(0.3, 0.8)
+        elif stage == "convert":
+            user_data = users_by_id.get(user_id)
+            if user_data is None:
+                clear_failure("convert", user_id)
+                continue
+            user_model_data = convert_scraped_user(
+                user_data, find_seed_record(seed_format_users, seed_index, user_data))
+            if user_model_data:
+                upsert_seed_record(seed_format_users, seed_index, user_model_data)
+
+    save_outputs(all_scraped_user_data, seed_format_users, append=False)
+    logging.info(f"Retry finished: {len(dead_letters)} dead-letter entries remain")
+
+
+def positive_int(value):
+    """argparse type for options that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape zbeng profiles or generate seed data for the server.")
+    parser.add_argument('mode', nargs='?', default='crawl', choices=['crawl', 'synth', 'validate', 'retry-failed', 'refresh', 'export', 'query', 'serve',
+                                 'sample', 'dedupe-photos'],
+                        help="crawl: scrape the site (default). synth: generate synthetic seed users offline. "
+                             "validate: check a seed file against the User model. "
+                             "retry-failed: reprocess only dead-lettered failures. "
+                             "refresh: update known profiles whose listing entry changed. "
+                             "export: write the raw and seed records to Parquet for analytics. "
+                             "query: look up user IDs in the profile index. "
+                             "serve: run incremental crawls on a schedule with warm state and a status endpoint. "
+                             "sample: draw N seed users with a target gender/tier/age/city mix. "
+                             "dedupe-photos: find near-duplicate photos and skip-list them for conversion.")
+    parser.add_argument('--count', type=positive_int, default=100000, help="synth: number of users to generate. sample: users to draw")
+    parser.add_argument('--chunk-size', type=positive_int, default=SYNTH_CHUNK_SIZE, help="synth: users per written chunk")
+    parser.add_argument('--seed', type=int, default=None, help="synth/sample: random seed for reproducible output")
+    parser.add_argument('--output', default=None,
+                        help="synth/sample: output JSONL path, compressed by extension (shard directory with --shard-bytes). "
+                             f"export: Parquet directory (default: {PARQUET_DIRNAME} in the output directory)")
+    parser.add_argument('--input', default=None,
+                        help="validate/sample: seed JSON or JSONL file (default: the crawl's seed_users_with_photos.json)")
+    parser.add_argument('--shard-bytes', type=positive_int, default=None,
+                        help=f"synth/sample: write size-bounded shards plus a manifest instead of one JSONL file "
+                             f"(the crawl always shards at {SEED_SHARD_MAX_BYTES} bytes)")
+    parser.add_argument('--recheck-days', type=float, default=None,
+                        help="refresh: also re-fetch details last fetched more than this many days ago")
+    parser.add_argument('--base-url', default=None,
+                        help="crawl/refresh/retry-failed: site root to scrape (default: ZBENG_BASE_URL or the real site)")
+    parser.add_argument('--delay-scale', type=float, default=None,
+                        help="multiplier for polite delays between requests; 0 disables them (default: ZBENG_DELAY_SCALE or 1)")
+    parser.add_argument('--interval-minutes', type=float, default=SERVE_INTERVAL_MINUTES,
+                        help="serve: minutes between scheduled crawls")
+    parser.add_argument('--port', type=int, default=SERVE_PORT, help="serve: local status/metrics/trigger port")
+    parser.add_argument('--where', action='append', metavar='FIELD=VALUE',
+                        help=f"query: filter on an index field, repeatable ({', '.join(PROFILE_INDEX_FIELDS)})")
+    parser.add_argument('--username', default=None, help="query: print the user_id behind a seed username")
+    parser.add_argument('--mix', action='append', metavar='DIM=VALUE:SHARE,...',
+                        help=f"sample: target shares for one dimension, repeatable ({', '.join(SAMPLE_DIMENSIONS)}); "
+                             f"shares summing below 1 leave the rest to '{SAMPLE_OTHER}'. Age uses bands like 25-34")
+    parser.add_argument('--max-distance', type=int, default=PHOTO_DUPLICATE_DISTANCE,
+                        help="dedupe-photos: max Hamming distance between 64-bit hashes of duplicate photos")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"profile the whole run; reports go to {PROFILE_DIRNAME}/ in the output directory "
+                             "(SIGUSR1 toggles profiling on a running process)")
+    return parser.parse_args(argv)
 
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.base_url:
+        set_base_url(args.base_url)
+    if args.delay_scale is not None:
+        POLITE_DELAY_SCALE = args.delay_scale
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, toggle_profiling)
+    if args.profile:
+        start_profiling()
+    try:
+        if args.mode == 'synth':
+            generate_synthetic_seed(args.count, args.output, args.chunk_size, args.seed, args.shard_bytes)
+        elif args.mode == 'validate':
+            validate_seed_file(args.input)
+        elif args.mode == 'retry-failed':
+            retry_failed()
+        elif args.mode == 'refresh':
+            refresh_profiles(args.recheck_days)
+        elif args.mode == 'export':
+            export_parquet(args.output)
+        elif args.mode == 'query':
+            run_query(args.where, args.username)
+        elif args.mode == 'serve':
+            serve(args.interval_minutes, args.port)
+        elif args.mode == 'sample':
+            sample_seed_users(args.count, args.mix, args.input, args.output, args.seed, args.shard_bytes)
+        elif args.mode == 'dedupe-photos':
+            dedupe_photos(args.max_distance)
+        else:
+            main()
+    finally:
+        # Also on errors and Ctrl-C, so a profiled run that dies still leaves its reports
+        stop_profiling()
@@ -0,0 +1,406 @@
+"""
+Local stand-in for the zbeng endpoints the scraper uses, served from fixtures so a full crawl can be
+run, timed and regression-tested offline:
+
+    python standin_server.py --port 8765 --users 2000 --latency-ms 40 --error-rate 0.01 --rate-limit-rate 0.02
+    python standin_server.py --port 8765 --truncate-rate 0.1  # cut photo bodies short to exercise resuming
+    ZBENG_BASE_URL=http://127.0.0.1:8765 ZBENG_DELAY_SCALE=0 python scrap_zbeng.py crawl
+
+Fixtures are either generated deterministically from --seed, or built from a scraped history file
+(--fixtures users_data_complete.json[.gz|.zst]) so real nicknames, tags and locations are replayed.
+GET /__stats returns request counts per endpoint and status.
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import zstandard  # Only needed for .zst fixture files
+except ImportError:
+    zstandard = None
+
+# --- Configuration ---
+DEFAULT_PORT = 8765
+DEFAULT_USERS = 500
+DEFAULT_PER_PAGE = 20
+FIRST_USER_ID = 600000
+# Sizes the scraper treats as the site's "no photo" placeholder (download_photo deletes these)
+PLACEHOLDER_IMAGE_SIZES = (24381, 15905, 16971)
+PHOTO_SIZE_RANGE = (30000, 120000)
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server", "uploads", "seed")
+
+# --- Fixture Vocabulary ---
+FIXTURE_GENDERS = (("male", 1, "בן"), ("female", 2, "בת"), ("couple", 3, "זוג"))
+FIXTURE_GENDER_WEIGHTS = (0.6, 0.25, 0.15)
+FIXTURE_MARITAL = {"male": ("רווק", "נשוי", "גרוש"), "female": ("רווקה", "נשואה", "גרושה"), "couple": ("",)}
+FIXTURE_NICKNAMES = ("דנה", "מושיקו", "ארוך מאוד", "יוסי", "שרון", "Tal", "Dana", "צביקה", "אורי", "נועה",
+                     "TLV Couple", "זוג חמוד", "Lior", "רוני", "Gal")
+FIXTURE_LOCATIONS = ("תל אביב - יפו", "חיפה", "ירושלים", "פתח תקווה", "רמת גן", "אשדוד", "באר שבע", "נתניה",
+                     "ראשון לציון", "הרצליה", "רעננה", "נהריה", "עפולה", "כפר סבא", "")
+FIXTURE_TAGS = ("רומנטי", "הומור", "ספורט", "טיולים", "יין", "מוזיקה", "ריקודים", "בישול", "סרטים", "ים")
+FIXTURE_RATINGS = ("8.5 (טוב מאוד)", "8.1 (טוב מאוד)", "6.6 (טוב)", "9.2 (מצוין)")
+
+
+# --- Fixtures ---
+def open_fixture_file(path):
+    """Open a fixture file for text reading, picking the codec from the extension."""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed; install zstandard to read it")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def generate_profiles(count, seed=None):
+    """Deterministic synthetic profiles in the stand-in's internal format."""
+    rng = random.Random(seed)
+    profiles = []
+    for i in range(count):
+        gender, gender_id, gender_he = rng.choices(FIXTURE_GENDERS, FIXTURE_GENDER_WEIGHTS)[0]
+        age = rng.randint(18, 70)
+        photo_flags = [rng.random() < p for p in (0.5, 0.3, 0.15)]
+        profiles.append({
+            "user_id": str(FIRST_USER_ID + i),
+            "nickname": f"{rng.choice(FIXTURE_NICKNAMES)}{rng.randint(1, 99)}",
+            "gender": gender, "gender_id": gender_id, "gender_he": gender_he,
+            "age": age,
+            "location": rng.choice(FIXTURE_LOCATIONS),
+            "marital": rng.choice(FIXTURE_MARITAL[gender]),
+            "about_me": "<p>" + "<br>".join(rng.sample(FIXTURE_TAGS, 2)) + " &amp; עוד</p>",
+            "general": "",
+            "score": rng.choice(FIXTURE_RATINGS),
+            "view_count": rng.randint(0, 5000),
+            "favorite_count": rng.randint(0, 300),
+            "created_on": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2015, 2025)}",
+            "last_login": f"{rng.randint(1, 59)} דקות",
+            "iam_tags": rng.sample(FIXTURE_TAGS, rng.randint(0, 3)),
+            "basic": "",
+            "looking_for_tags": rng.sample(FIXTURE_TAGS, rng.randint(0, 3)),
+            "turns_on_tags": rng.sample(FIXTURE_TAGS, rng.randint(0, 3)),
+            "photo_flags": photo_flags,
+        })
+    return profiles
+
+
+def profiles_from_history(path):
+    """Build profiles from a scraped raw history file (JSON array or JSONL, optionally compressed)."""
+    genders = {gender: (gender_id, gender_he) for gender, gender_id, gender_he in FIXTURE_GENDERS}
+    with open_fixture_file(path) as f:
+        if ".jsonl" in os.path.basename(path):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = json.load(f)
+    profiles = []
+    for record in records:
+        if not record.get('user_id'):
+            continue
+        gender = record.get('gender_popup_en') or record.get('gender_listing') or "male"
+        gender_id, gender_he = genders.get(gender, genders["male"])
+        numbers = {url.rsplit("number=", 1)[-1] for url in record.get('photo_urls_popup') or []}
+        profiles.append({
+            "user_id": str(record['user_id']),
+            "nickname": record.get('nickname_listing') or record.get('nickname_popup') or "",
+            "gender": gender, "gender_id": gender_id, "gender_he": gender_he,
+            "age": record.get('age_popup') or record.get('age_listing') or 30,
+            "location": record.get('location_listing') or "",
+            "marital": record.get('marital_status_popup_he') or "",
+            "about_me": (record.get('about_me_popup') or "").replace("\n", "<br>"),
+            "general": record.get('general_description_popup') or "",
+            "score": record.get('rating_popup') or "",
+            "view_count": record.get('view_count_popup') or 0,
+            "favorite_count": record.get('favorite_count_popup') or 0,
+            "created_on": record.get('registration_date_popup') or "",
+            "last_login": record.get('last_login_popup') or "",
+            "iam_tags": record.get('i_am_tags_popup') or [],
+            "basic": record.get('iam_into_summary_popup') or "",
+            "looking_for_tags": record.get('iam_looking_for_tags_popup') or [],
+            "turns_on_tags": record.get('turns_me_on_tags_popup') or [],
+            "photo_flags": [str(n) in numbers for n in (2, 3, 4)],
+        })
+    return profiles
+
+
+# Leading bytes -> content type, so photos are labelled by what they are rather than by file name
+IMAGE_CONTENT_TYPES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def image_content_type(data):
+    """Content type of an image from its magic bytes, or None for anything that is not an image."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return next((content_type for magic, content_type in IMAGE_CONTENT_TYPES if data.startswith(magic)), None)
+
+
+def load_image_pool(image_dir=IMAGE_DIR):
+    """Image files served as profile photos; falls back to generated bytes when none are found."""
+    pool = []
+    if os.path.isdir(image_dir):
+        for name in sorted(os.listdir(image_dir)):
+            path = os.path.join(image_dir, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            content_type = image_content_type(data)
+            if content_type and len(data) not in PLACEHOLDER_IMAGE_SIZES:
+                pool.append((content_type, data))
+    return pool
+
+
+# --- Rendering ---
+def render_listing_page(profiles, page_num, per_page):
+    """online.aspx?page=N&view=2 markup, matching what parse_users_from_listing reads."""
+    total_pages = max(1, math.ceil(len(profiles) / per_page))
+    parts = ['<html><body><div id="contentMain_customers">']
+    for profile in profiles[(page_num - 1) * per_page:page_num * per_page]:
+        user_id = profile['user_id']
+        location = f", {profile['location']}" if profile['location'] else ""
+        parts.append(
+            f'<div class="adv" onclick="showProfil({user_id})">'
+            f'<img id="imgCustomer_{user_id}" src="/picture.ashx?customerId={user_id}&number=1">'
+            f'<div class="inf1">{profile["gender_he"]} {profile["age"]}{location}</div>'
+            f'<p id="lblNickName_{user_id}">{profile["nickname"]}</p></div>')
+    parts.append('<div id="contentMain_customers_pager">')
+    for k in range(total_pages):
+        parts.append(f'<a id="contentMain_customers_pager_rptPager_lnkPage_{k}" '
+                     f'href="online.aspx?page={k + 1}&view=2">{k + 1}</a>')
+    parts.append('</div></div></body></html>')
+    return "".join(parts)
+
+
+def render_profile_json(profile):
+    """/api/getprofile response, matching what parse_user_details_from_json reads."""
+    me = " ".join(part for part in (profile['marital'], f"{profile['gender_he']} {profile['age']}") if part)
+    response = {
+        "name": profile['nickname'], "genderId": profile['gender_id'], "me": me,
+        "aboutMe": profile['about_me'], "general": profile['general'], "score": profile['score'],
+        "viewCount": profile['view_count'], "favoritCount": profile['favorite_count'],
+        "createdOn": profile['created_on'], "lastLogIn": profile['last_login'],
+        "iamTag": ",".join(profile['iam_tags']), "basic": profile['basic'],
+        "iamLookingForTag": ",".join(profile['looking_for_tags']),
+        "makesMeItTag": ",".join(profile['turns_on_tags']),
+    }
+    for number, flag in zip((2, 3, 4), profile['photo_flags']):
+        response[f"img{number}"] = flag
+    return json.dumps(response, ensure_ascii=False)
+
+
+# --- Server ---
+class StandinState:
+    """Fixtures, fault settings and request counters shared by the handler threads."""
+
+    def __init__(self, profiles, per_page=DEFAULT_PER_PAGE, latency_ms=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 placeholder_rate=0.0, seed=None, image_pool=None, truncate_rate=0.0):
+        self.profiles = profiles
+        self.profiles_by_id = {profile['user_id']: profile for profile in profiles}
+        self.per_page = per_page
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.placeholder_rate = placeholder_rate
+        self.truncate_rate = truncate_rate
+        self.seed = seed
+        self.image_pool = image_pool or []
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def roll(self):
+        with self.lock:
+            return self.rng.random()
+
+    def count(self, endpoint, status):
+        with self.lock:
+            self.stats[f"{endpoint} {status}"] += 1
+
+    def photo(self, user_id, number):
+        """(content_type, bytes) for a photo; deterministic per user and photo number."""
+        profile = self.profiles_by_id.get(user_id)
+        has_photo = profile is not None and (number == 1 or (2 <= number <= 4 and profile['photo_flags'][number - 2]))
+        photo_rng = random.Random(f"{self.seed}:{user_id}:{number}")
+        if not has_photo or photo_rng.random() < self.placeholder_rate:
+            size = PLACEHOLDER_IMAGE_SIZES[0]
+            return "image/jpeg", b"\xff\xd8\xff\xe0" + bytes(size - 6) + b"\xff\xd9"
+        if self.image_pool:
+            return self.image_pool[photo_rng.randrange(len(self.image_pool))]
+        size = photo_rng.randint(*PHOTO_SIZE_RANGE)
+        while size in PLACEHOLDER_IMAGE_SIZES:
+            size += 1
+        return "image/jpeg", b"\xff\xd8\xff\xe0" + photo_rng.randbytes(size - 6) + b"\xff\xd9"
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_version = "ZbengStandin/1.0"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+    def send_body(self, endpoint, status, body, content_type):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+        self.state.count(endpoint, status)
+
+    def send_photo(self, content_type, data):
+        """Send a photo, honouring "Range: bytes=N-"; may cut the body short to simulate a reset."""
+        status, start = 200, 0
+        requested = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        etag = f'"{zlib.crc32(data):08x}"'
+        if requested and self.headers.get("If-Range", etag) == etag:
+            status, start = 206, int(requested.group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                self.state.count("picture", 416)
+                return
+        body = data[start:]
+        truncated = self.state.roll() < self.state.truncate_rate
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 2] if truncated else body)
+        if truncated:
+            self.close_connection = True
+        self.state.count("picture", f"{status} truncated" if truncated else status)
+
+    def inject_faults(self, endpoint):
+        """Apply latency, then maybe answer 429 or 500. Returns True if a fault response was sent."""
+        state = self.state
+        if state.latency_ms:
+            time.sleep(state.latency_ms / 1000.0 * (0.5 + state.roll()))
+        roll = state.roll()
+        if roll < state.rate_limit_rate:
+            self.send_body(endpoint, 429, "Too Many Requests", "text/plain")
+            return True
+        if roll < state.rate_limit_rate + state.error_rate:
+            self.send_body(endpoint, 500, "Internal Server Error", "text/plain")
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.lower()
+        if path == "/__stats":
+            with self.state.lock:
+                stats = dict(self.state.stats)
+            self.send_body("stats", 200, json.dumps(stats, indent=2), "application/json")
+        elif path == "/online.aspx":
+            if self.inject_faults("listing"):
+                return
+            try:
+                page_num = max(1, int(query.get("page", ["1"])[0]))
+            except ValueError:
+                page_num = 1
+            html = render_listing_page(self.state.profiles, page_num, self.state.per_page)
+            self.send_body("listing", 200, html, "text/html; charset=utf-8")
+        elif path == "/picture.ashx":
+            if self.inject_faults("picture"):
+                return
+            try:
+                number = int(query.get("number", ["1"])[0])
+            except ValueError:
+                number = 1
+            content_type, data = self.state.photo(query.get("customerId", [""])[0], number)
+            self.send_photo(content_type, data)
+        else:
+            self.send_body("other", 404, "Not Found", "text/plain")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.lower() != "/api/getprofile":
+            self.send_body("other", 404, "Not Found", "text/plain")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode('utf-8')) if length else {}
+        if self.inject_faults("profile"):
+            return
+        user_id = (form.get("customerId") or parse_qs(url.query).get("customerId") or [""])[0]
+        profile = self.state.profiles_by_id.get(user_id)
+        if profile is None:
+            self.send_body("profile", 404, "{}", "application/json")
+            return
+        self.send_body("profile", 200, render_profile_json(profile), "application/json; charset=utf-8")
+
+
+def start_standin_server(state, host="127.0.0.1", port=DEFAULT_PORT):
+    """Serve `state` on a background thread. Returns (server, base_url); stop with server.shutdown()."""
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="standin-server", daemon=True).start()
+    base_url = f"http://{host}:{server.server_address[1]}"
+    logging.info(f"Stand-in server for {len(state.profiles)} profiles listening on {base_url}")
+    return server, base_url
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve zbeng listing, profile and picture endpoints from fixtures.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="0 picks a free port")
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS, help="number of generated profiles")
+    parser.add_argument('--fixtures', default=None, help="raw history file to serve instead of generated profiles")
+    parser.add_argument('--per-page', type=int, default=DEFAULT_PER_PAGE, help="profiles per listing page")
+    parser.add_argument('--seed', type=int, default=0, help="seed for fixtures, faults and photo bytes")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="mean added latency (uniform 0.5x-1.5x)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="fraction answered with 429")
+    parser.add_argument('--placeholder-rate', type=float, default=0.0,
+                        help="fraction of photos served as the site's 'no photo' placeholder")
+    parser.add_argument('--truncate-rate', type=float, default=0.0,
+                        help="fraction of photo responses cut off halfway (Range requests resume them)")
+    parser.add_argument('--image-dir', default=IMAGE_DIR, help="images served as photos (generated if empty)")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args()
+    profiles = profiles_from_history(args.fixtures) if args.fixtures else generate_profiles(args.users, args.seed)
+    state = StandinState(profiles, args.per_page, args.latency_ms, args.error_rate, args.rate_limit_rate,
+                         args.placeholder_rate, args.seed, load_image_pool(args.image_dir), args.truncate_rate)
+    server, _ = start_standin_server(state, args.host, args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        logging.info(f"Requests served: {dict(state.stats)}")
@@ -96,6 +96,11 @@ const userSchema = new Schema({
       trim:      true,
       maxlength: [100, 'Location cannot exceed 100 characters'],
     },
+    // GeoJSON point ([longitude, latitude]) of the canonical locality; left unset when unknown
+    geo: {
+      type:        { type: String, enum: ['Point'] },
+      coordinates: { type: [Number], default: undefined },
+    },
     bio: {
       type:      String,
       trim:      true,
@@ -239,6 +244,9 @@ userSchema.virtual('isSubscriptionActive').get(function() {
 // Text search indexes
 userSchema.index({ 'details.location': 'text', 'details.interests': 'text' });
 
+// Geospatial index for proximity queries on seeded and scraped locations
+userSchema.index({ 'details.geo': '2dsphere' });
+
 // Compound indexes
 userSchema.index({ isOnline: 1, lastActive: -1 });
 userSchema.index({ 'details.age': 1, 'details.gender': 1 });
@@ -4,6 +4,7 @@ import fs from 'fs';
 import path from 'path';
 import { fileURLToPath } from 'url';
 import crypto from 'crypto';
+import zlib from 'zlib';
 
 // --- Configuration ---
 const MONGO_URI = 'mongodb://localhost:27017/mandarin';
@@ -20,6 +21,52 @@ import logger from './logger.js';
 const getRandomInt = (min, max) => Math.floor(Math.random() * (max - min + 1)) + min;
 const getRandomElement = (arr) => arr[Math.floor(Math.random() * arr.length)];
 
+// Read a scraper data file, decompressing it by extension (.zst, .gz or none)
+const readDataFile = (filePath) => {
+  if (filePath.endsWith('.zst')) {
+    if (typeof zlib.zstdDecompressSync !== 'function') {
+      throw new Error(`${filePath} is zstd-compressed; use Node 22.15+ or re-run the scraper without ZBENG_COMPRESSION=zstd`);
+    }
+    return zlib.zstdDecompressSync(fs.readFileSync(filePath));
+  }
+  if (filePath.endsWith('.gz')) {
+    return zlib.gunzipSync(fs.readFileSync(filePath));
+  }
+  return fs.readFileSync(filePath);
+};
+
+// Read a scraper output file, which may be stored as .zst, .gz or plain JSON
+const readScrapedFile = (basePath) => {
+  const filePath = [`${basePath}.zst`, `${basePath}.gz`].find((candidate) => fs.existsSync(candidate)) || basePath;
+  return readDataFile(filePath).toString('utf8');
+};
+
+// Read the sharded seed output listed in <shardDir>/manifest.json, checking each shard's record
+// count and checksum. Returns null when there is no manifest, so callers can fall back to the
+// single seed file.
+const readSeedShards = (shardDir) => {
+  const manifestPath = path.join(shardDir, 'manifest.json');
+  if (!fs.existsSync(manifestPath)) {
+    return null;
+  }
+  const manifest = JSON.parse(fs.readFileSync(manifestPath, 'utf8'));
+  const users = [];
+  for (const shard of manifest.shards) {
+    const data = readDataFile(path.join(shardDir, shard.file));
+    const sha256 = crypto.createHash('sha256').update(data).digest('hex');
+    if (sha256 !== shard.sha256) {
+      throw new Error(`Seed shard ${shard.file} does not match its manifest checksum`);
+    }
+    const records = data.toString('utf8').split('\n').filter((line) => line.trim()).map((line) => JSON.parse(line));
+    if (records.length !== shard.records) {
+      throw new Error(`Seed shard ${shard.file} holds ${records.length} records, manifest says ${shard.records}`);
+    }
+    users.push(...records);
+  }
+  logger.info(`Read ${users.length} users from ${manifest.shards.length} seed shard(s) in ${shardDir}`);
+  return users;
+};
+
 // Generate a random online status
 const generateOnlineStatus = () => {
   // 30% chance of being online
@@ -184,13 +231,13 @@ const seedDatabase = async () => {
     await mongoose.connect(MONGO_URI);
     logger.info('MongoDB connected for seeding scraped data.');
 
-    // Read scraped data (use the new file with correct photo mappings)
-    const scrapedDataPath = path.join(__dirname, '../scraper/scraped_data_zbeng_full_refactor/seed_users_with_photos.json');
+    // Read scraped data: the seed shards when the scraper wrote them, else the single seed file
+    const scrapedDataDir = path.join(__dirname, '../scraper/scraped_data_zbeng_full_refactor');
     let scrapedUsers = [];
     
     try {
-      const fileContent = fs.readFileSync(scrapedDataPath, 'utf8');
-      scrapedUsers = JSON.parse(fileContent);
+      scrapedUsers = readSeedShards(path.join(scrapedDataDir, 'seed_shards'))
+        || JSON.parse(readScrapedFile(path.join(scrapedDataDir, 'seed_users_with_photos.json')));
       
       // Fix photo paths from /uploads/photos/ to /uploads/images/
       scrapedUsers = scrapedUsers.map(user => {